@@ -24,6 +24,9 @@ class ContentTypeField(serializers.Field):
 class CustomListSerializer(serializers.ListSerializer):
     def to_representation(self, data):
         iterable = data.all() if isinstance(data, models.Manager) else data
+        iterable = list(iterable)
+        # Loads the related objects of the whole page at once
+        Notification.prime_related_objects(iterable)
         data_list = []
         for item in iterable:
             try:
@@ -12,6 +12,7 @@ from rest_framework.generics import (
     get_object_or_404,
 )
 from rest_framework.mixins import CreateModelMixin, ListModelMixin, UpdateModelMixin
+from rest_framework.pagination import CursorPagination
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
@@ -47,6 +48,18 @@ class NotificationPaginator(OpenWispPagination):
     page_size = 20
 
 
+class NotificationCursorPaginator(CursorPagination):
+    """
+    Keyset pagination which does not count the notifications
+    and does not get slower on deep pages.
+    """
+
+    page_size = NotificationPaginator.page_size
+    page_size_query_param = NotificationPaginator.page_size_query_param
+    max_page_size = NotificationPaginator.max_page_size
+    ordering = ("-timestamp", "-id")
+
+
 class BaseNotificationView(GenericAPIView):
     model = Notification
     authentication_classes = [BearerAuthentication, SessionAuthentication]
@@ -63,10 +76,17 @@ class BaseNotificationView(GenericAPIView):
 
 class NotificationListView(BaseNotificationView, ListModelMixin):
     serializer_class = NotificationListSerializer
-    pagination_class = NotificationPaginator
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ["unread"]
 
+    @property
+    def pagination_class(self):
+        # "?pagination=cursor" enables the keyset pagination
+        request = getattr(self, "request", None)
+        if request and request.query_params.get("pagination") == "cursor":
+            return NotificationCursorPaginator
+        return NotificationPaginator
+
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
 
@@ -110,8 +130,8 @@ class NotificationReadAllView(BaseNotificationView):
         queryset = self.get_queryset()
         queryset.filter(unread=True).update(unread=False)
         # update() does not create post_save signal, therefore
-        # manual invalidation of cache is required
-        Notification.invalidate_unread_cache(request.user)
+        # the unread counter has to be reset manually
+        Notification.reset_unread_count(request.user)
         return Response(status=status.HTTP_200_OK)
 
 
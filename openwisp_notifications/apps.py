@@ -12,10 +12,12 @@ class OpenwispNotificationsConfig(AppConfig):
 
     def ready(self):
         from openwisp_notifications.handlers import (
+            connect_related_object_deleted,
             notification_type_registered_unregistered_handler,
             notify_handler,
         )
         from openwisp_notifications.signals import notify
+        from openwisp_notifications.types import NOTIFICATION_ASSOCIATED_MODELS
 
         notify.connect(
             notify_handler, dispatch_uid="openwisp_notifications.model.notifications"
@@ -26,6 +28,7 @@ class OpenwispNotificationsConfig(AppConfig):
                 sender=self,
                 dispatch_uid="register_unregister_notification_types",
             )
+        connect_related_object_deleted(NOTIFICATION_ASSOCIATED_MODELS)
 
         # Add CORS configuration checks
         from openwisp_notifications.checks import check_cors_configuration  # noqa
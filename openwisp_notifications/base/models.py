@@ -11,27 +11,33 @@ from django.contrib.sites.models import Site
 from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.db import models, transaction
+from django.db.models import BooleanField, Case, Value, When
 from django.db.models.constraints import UniqueConstraint
-from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.html import mark_safe
 from django.utils.module_loading import import_string
+from django.utils.translation import get_language
 from django.utils.translation import gettext_lazy as _
-from markdown import markdown
 from swapper import get_model_name
 
 from openwisp_notifications import settings as app_settings
 from openwisp_notifications.exceptions import NotificationRenderException
 from openwisp_notifications.types import (
     NOTIFICATION_CHOICES,
+    get_message_template,
     get_notification_choices,
     get_notification_configuration,
+    get_notification_type_registration,
 )
 from openwisp_notifications.utils import (
+    LRUCache,
     _get_absolute_url,
     _get_object_link,
+    get_cache_version,
+    invalidate_cache_version,
+    render_markdown,
     send_notification_email,
 )
 from openwisp_utils.base import UUIDModel
@@ -41,6 +47,9 @@ from .notifications import AbstractNotification as BaseNotification
 
 logger = logging.getLogger(__name__)
 
+# Rendered messages and descriptions of notifications
+_rendered_notifications = LRUCache(app_settings.RENDER_CACHE_SIZE)
+
 
 @contextmanager
 def notification_render_attributes(obj, **attrs):
@@ -128,7 +137,8 @@ class AbstractNotification(UUIDModel, BaseNotification):
 
     @classmethod
     def count_cache_key(cls, user_pk):
-        return cls._cache_key(f"unread-{user_pk}")
+        # The counter holds the raw number of unread notifications
+        return cls._cache_key(f"unread-count-{user_pk}")
 
     @classmethod
     def invalidate_unread_cache(cls, user):
@@ -137,6 +147,62 @@ class AbstractNotification(UUIDModel, BaseNotification):
         """
         cache.delete(cls.count_cache_key(user.pk))
 
+    @classmethod
+    def get_unread_count(cls, user):
+        """
+        Returns the number of unread notifications of ``user``.
+
+        The value is read from the unread counter of the user,
+        which is initialized by counting the unread notifications
+        in the database when it is not cached.
+        """
+        count = cache.get(cls.count_cache_key(user.pk))
+        if count is None:
+            count = cls.init_unread_count(user.pk, user.notifications.unread().count())
+        return count
+
+    @classmethod
+    def init_unread_count(cls, user_pk, count):
+        """
+        Initializes the unread counter of the user with ``count``,
+        unless the counter has been initialized concurrently.
+        """
+        cache_key = cls.count_cache_key(user_pk)
+        if cache.add(cache_key, count, timeout=app_settings.CACHE_TIMEOUT):
+            return count
+        cached = cache.get(cache_key)
+        return count if cached is None else cached
+
+    @classmethod
+    def update_unread_counts(cls, deltas):
+        """
+        Atomically increments the unread counters of the users
+        with the values of ``deltas``, a dictionary which maps
+        user primary keys to a (positive or negative) integer.
+
+        Counters which are not cached are left untouched, they
+        will be initialized on the next read.
+        """
+        for user_pk, delta in deltas.items():
+            if not delta:
+                continue
+            try:
+                cache.incr(cls.count_cache_key(user_pk), delta)
+            except ValueError:
+                continue
+
+    @classmethod
+    def reset_unread_count(cls, user):
+        cache.set(cls.count_cache_key(user.pk), 0, timeout=app_settings.CACHE_TIMEOUT)
+
+    @classmethod
+    def aggregation_cache_key(
+        cls, recipient_pk, type, target_content_type_pk, target_pk
+    ):
+        return cls._cache_key(
+            "aggregate", recipient_pk, type, target_content_type_pk, target_pk
+        )
+
     @classmethod
     def get_user_batched_notifications_cache_key(cls, user):
         if isinstance(user, get_user_model()):
@@ -242,6 +308,9 @@ class AbstractNotification(UUIDModel, BaseNotification):
 
     @cached_property
     def message(self):
+        return self._cached_render("message", self._render_message)
+
+    def _render_message(self):
         with notification_render_attributes(self):
             return self.get_message()
 
@@ -249,16 +318,85 @@ class AbstractNotification(UUIDModel, BaseNotification):
     def rendered_description(self):
         if not self.description:
             return ""
+        return self._cached_render("description", self._render_description)
+
+    def _render_description(self):
         with notification_render_attributes(self):
             data = self.data or {}
             desc = self.description.format(notification=self, **data)
-        return mark_safe(markdown(desc))
+        return mark_safe(render_markdown(desc))
 
     @property
     def email_message(self):
+        return self._cached_render("email_message", self._render_email_message)
+
+    def _render_email_message(self):
         with notification_render_attributes(self, target_link="redirect_view_url"):
             return self.get_message()
 
+    @classmethod
+    def _render_version_key(cls, obj_content_type_id, obj_id):
+        return cls._cache_key("render-version", obj_content_type_id, obj_id)
+
+    @classmethod
+    def invalidate_render_cache(cls, obj_content_type_id, obj_id):
+        """
+        Discards the rendered contents of the notifications
+        having the specified object as related object.
+        """
+        invalidate_cache_version(cls._render_version_key(obj_content_type_id, obj_id))
+
+    def _render_version_keys(self):
+        keys = []
+        for field in ("actor", "action_object", "target"):
+            obj_id = getattr(self, f"{field}_object_id")
+            if obj_id:
+                keys.append(
+                    self._render_version_key(
+                        getattr(self, f"{field}_content_type_id"), obj_id
+                    )
+                )
+        return keys
+
+    def _cached_render(self, kind, render):
+        """
+        Returns the rendered ``kind`` content of the notification from
+        the in-process LRU cache, the cached content is discarded when
+        the notification, its type or its related objects change.
+        """
+        if self._state.adding or not app_settings.RENDER_CACHE_SIZE:
+            return render()
+        for field in ("actor", "action_object", "target"):
+            # Contents of notifications having missing related
+            # objects are neither cached nor read from the cache
+            if getattr(self, f"{field}_object_id") and not self._related_object(field):
+                return render()
+        try:
+            get_notification_configuration(self.type)
+        except NotificationRenderException:
+            # Rendering takes care of notifications of unregistered types
+            return render()
+        version = getattr(self, "_primed_render_version", None)
+        if version is None:
+            version = get_cache_version(*self._render_version_keys())
+        key = (
+            str(self.pk),
+            kind,
+            get_language(),
+            # Contents rendered before the type was registered
+            # again with a different configuration are discarded
+            get_notification_type_registration(self.type),
+            str(self.timestamp),
+            self.description,
+            repr(self.data),
+            version,
+        )
+        rendered = _rendered_notifications.get(key)
+        if rendered is None:
+            rendered = render()
+            _rendered_notifications.set(key, rendered)
+        return rendered
+
     def get_message(self):
         try:
             config = get_notification_configuration(self.type)
@@ -268,16 +406,18 @@ class AbstractNotification(UUIDModel, BaseNotification):
             elif "message" in config:
                 md_text = config["message"].format(notification=self, **data)
             else:
-                md_text = render_to_string(
-                    config["message_template"], context=dict(notification=self, **data)
-                ).strip()
+                md_text = (
+                    get_message_template(config["message_template"])
+                    .render(context=dict(notification=self, **data))
+                    .strip()
+                )
         except (AttributeError, KeyError, NotificationRenderException) as exception:
             self._invalid_notification(
                 self.pk,
                 exception,
                 "Error encountered in rendering notification message",
             )
-        return mark_safe(markdown(md_text))
+        return mark_safe(render_markdown(md_text))
 
     @cached_property
     def email_subject(self):
@@ -295,6 +435,9 @@ class AbstractNotification(UUIDModel, BaseNotification):
             )
 
     def _related_object(self, field):
+        primed = getattr(self, "_primed_related_objects", None)
+        if primed is not None and field in primed:
+            return primed[field]
         obj_id = getattr(self, f"{field}_object_id")
         obj_content_type_id = getattr(self, f"{field}_content_type_id")
         if not obj_id:
@@ -322,6 +465,67 @@ class AbstractNotification(UUIDModel, BaseNotification):
             )
         return obj
 
+    @classmethod
+    def prime_related_objects(cls, notifications):
+        """
+        Loads the "actor", "action_object" and "target" related objects
+        of ``notifications``, and the versions of their rendered contents,
+        with one cache lookup and at most one query for each content type,
+        instead of a few lookups for each object.
+        """
+        fields = ("actor", "action_object", "target")
+        cache_keys = {}
+        version_keys = []
+        for notification in notifications:
+            for field in fields:
+                obj_id = getattr(notification, f"{field}_object_id")
+                if obj_id:
+                    obj_content_type_id = getattr(
+                        notification, f"{field}_content_type_id"
+                    )
+                    cache_keys[cls._cache_key(obj_content_type_id, obj_id)] = (
+                        obj_content_type_id,
+                        obj_id,
+                    )
+                    version_keys.append(
+                        cls._render_version_key(obj_content_type_id, obj_id)
+                    )
+        objects = cache.get_many(list(cache_keys) + version_keys)
+        missing = {}
+        for cache_key, (obj_content_type_id, obj_id) in cache_keys.items():
+            if not objects.get(cache_key):
+                missing.setdefault(obj_content_type_id, set()).add(obj_id)
+        fetched = {}
+        for obj_content_type_id, obj_ids in missing.items():
+            model = ContentType.objects.get_for_id(obj_content_type_id).model_class()
+            in_bulk = {}
+            if model is not None:
+                in_bulk = {
+                    str(pk): obj
+                    for pk, obj in model._base_manager.in_bulk(list(obj_ids)).items()
+                }
+            for obj_id in obj_ids:
+                cache_key = cls._cache_key(obj_content_type_id, obj_id)
+                fetched[cache_key] = in_bulk.get(str(obj_id))
+        if fetched:
+            cache.set_many(fetched, timeout=app_settings.CACHE_TIMEOUT)
+            objects.update(fetched)
+        for notification in notifications:
+            notification._primed_related_objects = {
+                field: objects.get(
+                    cls._cache_key(
+                        getattr(notification, f"{field}_content_type_id"),
+                        getattr(notification, f"{field}_object_id"),
+                    )
+                )
+                for field in fields
+            }
+            keys = notification._render_version_keys()
+            if all(key in objects for key in keys):
+                notification._primed_render_version = "-".join(
+                    objects[key] for key in keys
+                )
+
     def _invalid_notification(self, pk, exception, error_message):
         from openwisp_notifications.tasks import delete_notification
 
@@ -362,6 +566,28 @@ class AbstractNotification(UUIDModel, BaseNotification):
         self._meta.model.objects.bulk_update([self], fields=["emailed"])
 
 
+class NotificationSettingQuerySet(models.QuerySet):
+    """
+    Queryset operations which bypass model signals invalidate
+    the cached preference matrix of notification settings.
+    """
+
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        self.model.invalidate_preference_cache()
+        return rows
+
+    def bulk_create(self, *args, **kwargs):
+        objs = super().bulk_create(*args, **kwargs)
+        self.model.invalidate_preference_cache()
+        return objs
+
+    def bulk_update(self, *args, **kwargs):
+        rows = super().bulk_update(*args, **kwargs)
+        self.model.invalidate_preference_cache()
+        return rows
+
+
 class AbstractNotificationSetting(UUIDModel):
     _RECEIVE_HELP = (
         "Note: Non-superadmin users receive "
@@ -403,6 +629,8 @@ class AbstractNotificationSetting(UUIDModel):
     # and must not be exposed through forms or APIs.
     _global = models.BooleanField(null=True, editable=False)
 
+    objects = NotificationSettingQuerySet.as_manager()
+
     class Meta:
         abstract = True
         constraints = [
@@ -584,6 +812,106 @@ class AbstractNotificationSetting(UUIDModel):
         """Returns ``True`` if ``user`` has at least one email notification setting enabled."""
         return cls.objects.filter(user=user, email=True).exists()
 
+    @staticmethod
+    def _preference_version_key(organization_id=None):
+        if organization_id is None:
+            return "ow-notifications-preferences-version"
+        return f"ow-notifications-preferences-version-{organization_id}"
+
+    @classmethod
+    def invalidate_preference_cache(cls, organization_id=None):
+        """
+        Invalidates the cached preference matrix of ``organization_id``,
+        or of all the organizations when ``organization_id`` is ``None``.
+        """
+        invalidate_cache_version(cls._preference_version_key(organization_id))
+
+    @classmethod
+    def get_preference_cache_version(cls, organization_id):
+        return get_cache_version(
+            cls._preference_version_key(),
+            cls._preference_version_key(organization_id),
+        )
+
+    @classmethod
+    def get_effective_preferences(cls, user_ids, organization_id, notification_type):
+        """
+        Returns the effective preferences of the users in ``user_ids``
+        for ``notification_type`` in the organization ``organization_id``
+        as a dictionary mapping the string representation of the user
+        ID to a ``(web, email)`` tuple of booleans.
+
+        Every cell of the (user, organization, type) matrix is cached
+        and invalidated whenever the notification settings of the user
+        or of the organization change. Missing cells are computed in
+        bulk with a single query.
+        """
+        user_ids = [str(user_id) for user_id in user_ids]
+        if not user_ids:
+            return {}
+        type_config = get_notification_configuration(notification_type)
+        prefix = "ow-notifications-preferences-{version}-{org}-{type}-{flags}".format(
+            version=cls.get_preference_cache_version(organization_id),
+            org=organization_id,
+            type=notification_type,
+            flags="".join(
+                str(int(bool(flag)))
+                for flag in (
+                    type_config["web_notification"],
+                    type_config["email_notification"],
+                    app_settings.WEB_ENABLED,
+                )
+            ),
+        )
+        cached = cache.get_many([f"{prefix}-{user_id}" for user_id in user_ids])
+        preferences = {}
+        missing = []
+        for user_id in user_ids:
+            cell = cached.get(f"{prefix}-{user_id}")
+            if cell is None:
+                missing.append(user_id)
+            else:
+                preferences[user_id] = tuple(cell)
+        if not missing:
+            return preferences
+        computed = dict.fromkeys(missing, (False, False))
+        settings_qs = (
+            cls.objects.filter(
+                user_id__in=missing,
+                organization_id=organization_id,
+                type=notification_type,
+            )
+            .select_related("organization__notification_settings")
+            .annotate(
+                # The raw value of the organization setting is needed here,
+                # the model field would resolve a NULL value to its fallback.
+                _organization_web=Case(
+                    When(organization__notification_settings__web=True, then=True),
+                    When(organization__notification_settings__web=False, then=False),
+                    default=Value(None),
+                    output_field=BooleanField(null=True),
+                )
+            )
+        )
+        for setting in settings_qs:
+            web = setting.web
+            if web is None:
+                web = type_config["web_notification"] and (
+                    setting._organization_web
+                    if setting._organization_web is not None
+                    else app_settings.WEB_ENABLED
+                )
+            computed[str(setting.user_id)] = (
+                bool(web) and not setting.deleted,
+                bool(setting.email_notification),
+            )
+        cache.set_many(
+            {f"{prefix}-{user_id}": cell for user_id, cell in computed.items()},
+            timeout=app_settings.CACHE_TIMEOUT,
+        )
+        preferences.update(computed)
+        return preferences
+
 
 class AbstractIgnoreObjectNotification(UUIDModel):
     """
@@ -98,9 +98,17 @@ class AbstractNotification(models.Model):
     class Meta:
         abstract = True
         ordering = ("-timestamp",)
-        # speed up notifications count query
         indexes = [
+            # speed up notifications count query
             models.Index(fields=["recipient", "unread"]),
+            # speed up the cursor pagination of the notification list
+            models.Index(fields=["recipient", "timestamp"]),
+            # speed up deletion of notifications of deleted objects
+            models.Index(fields=["actor_content_type", "actor_object_id"]),
+            models.Index(
+                fields=["action_object_content_type", "action_object_object_id"]
+            ),
+            models.Index(fields=["target_content_type", "target_object_id"]),
         ]
         verbose_name = _("Notification")
         verbose_name_plural = _("Notifications")
@@ -117,4 +125,6 @@ class AbstractNotification(models.Model):
     def mark_as_read(self):
         if self.unread:
             self.unread = False
+            # Allows decrementing the unread counter on save
+            self._marked_as_read = True
             self.save()
@@ -1,4 +1,7 @@
+import json
 import logging
+import threading
+import weakref
 from urllib.parse import quote
 
 from allauth.account.models import EmailAddress
@@ -8,6 +11,7 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.signals import user_logged_in
 from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import transaction
 from django.db.models import Q
 from django.db.models.query import QuerySet
@@ -19,14 +23,19 @@ from django.utils.html import format_html
 from django.utils.translation import gettext as _
 
 from openwisp_notifications import settings as app_settings
-from openwisp_notifications import tasks
+from openwisp_notifications import tasks, types
 from openwisp_notifications.exceptions import NotificationRenderException
 from openwisp_notifications.swapper import load_model, swapper_load_model
 from openwisp_notifications.types import (
     NOTIFICATION_ASSOCIATED_MODELS,
     get_notification_configuration,
 )
-from openwisp_notifications.utils import get_user_email_preference
+from openwisp_notifications.utils import (
+    get_cache_version,
+    get_email_notification_recipients,
+    get_user_email_preference,
+    invalidate_cache_version,
+)
 from openwisp_notifications.websockets import handlers as ws_handlers
 
 logger = logging.getLogger(__name__)
@@ -47,8 +56,135 @@ def notify_handler(**kwargs):
     """
     Handler function to create Notification instance upon action signal call.
     """
-    # Pull the options out of kwargs
     kwargs.pop("signal", None)
+    if app_settings.ASYNC_NOTIFY:
+        return schedule_notification(**kwargs)
+    return create_notifications(**kwargs)
+
+
+def _validate_target_url_suffix(target_url_suffix):
+    if target_url_suffix is not None and (
+        not isinstance(target_url_suffix, str)
+        or not target_url_suffix.startswith(("?", "&", "#"))
+    ):
+        raise ValueError(
+            _("target_url_suffix must be a string starting with '?', '&' or '#'.")
+        )
+
+
+def _serialize_object(obj):
+    if obj is None:
+        return None
+    return [ContentType.objects.get_for_model(obj).pk, str(obj.pk)]
+
+
+def _serialize_recipient(recipient):
+    if not recipient:
+        return None
+    if isinstance(recipient, Group):
+        return {"group": recipient.pk}
+    if isinstance(recipient, QuerySet):
+        return {"users": [str(pk) for pk in recipient.values_list("pk", flat=True)]}
+    if isinstance(recipient, list):
+        return {"users": [str(user.pk) for user in recipient]}
+    return {"users": [str(recipient.pk)]}
+
+
+def schedule_notification(**kwargs):
+    """
+    Serializes the arguments of the notify signal and delegates
+    the creation of notifications to a celery task, which is
+    executed only after the current transaction is committed.
+    """
+    if not kwargs.get("type"):
+        raise ValueError(_("Notification type is required."))
+    _validate_target_url_suffix(kwargs.get("target_url_suffix"))
+    actor = _serialize_object(kwargs.pop("sender"))
+    target = _serialize_object(kwargs.pop("target", None))
+    action_object = _serialize_object(kwargs.pop("action_object", None))
+    recipient = _serialize_recipient(kwargs.pop("recipient", None))
+    timestamp = kwargs.pop("timestamp", timezone.now()).isoformat()
+    # Lazy translation strings and other values supported by
+    # the "data" field are converted to their JSON representation.
+    options = json.loads(json.dumps(kwargs, cls=DjangoJSONEncoder))
+    transaction.on_commit(
+        lambda: tasks.notify_async.delay(
+            actor=actor,
+            recipient=recipient,
+            target=target,
+            action_object=action_object,
+            timestamp=timestamp,
+            **options,
+        )
+    )
+
+
+# Fields of the recipients loaded when notifications are created,
+# password and last_login are used in the token of unsubscribe links.
+RECIPIENT_FIELDS = ("pk", "email", "password", "last_login")
+
+
+def _recipients_version_key(organization_id=None):
+    if organization_id is None:
+        return "ow-notifications-recipients-version"
+    return f"ow-notifications-recipients-version-{organization_id}"
+
+
+def invalidate_recipients_cache(organization_id=None):
+    """
+    Invalidates the cached recipients of ``organization_id``,
+    or of all the organizations when ``organization_id`` is ``None``.
+    """
+    invalidate_cache_version(_recipients_version_key(organization_id))
+
+
+def get_eligible_recipient_ids(where, target_org, notification_type, type_config):
+    """
+    Returns the IDs of the users matching ``where`` which have web
+    notifications enabled for ``notification_type`` in ``target_org``.
+
+    The result is cached for each (organization, notification type)
+    pair and is invalidated when the organization users, the privileges
+    of users or the notification preferences change.
+    """
+    version_keys = [_recipients_version_key()]
+    if target_org:
+        version_keys.append(_recipients_version_key(target_org))
+    version = get_cache_version(*version_keys)
+    if target_org:
+        version = "{0}-{1}".format(
+            version, NotificationSetting.get_preference_cache_version(target_org)
+        )
+    cache_key = "ow-notifications-recipients-{0}-{1}-{2}-{3}{4}".format(
+        version,
+        target_org,
+        notification_type,
+        int(bool(type_config["web_notification"])),
+        int(bool(app_settings.WEB_ENABLED)),
+    )
+    recipient_ids = cache.get(cache_key)
+    if recipient_ids is not None:
+        return recipient_ids
+    recipient_ids = [
+        str(pk)
+        for pk in User.objects.filter(where).values_list("pk", flat=True).distinct()
+    ]
+    if target_org:
+        # Notification preference resolution (user setting -> org setting
+        # -> type default) is read from the cached preference matrix.
+        preferences = NotificationSetting.get_effective_preferences(
+            recipient_ids, target_org, notification_type
+        )
+        recipient_ids = [pk for pk in recipient_ids if preferences[pk][0]]
+    cache.set(cache_key, recipient_ids, timeout=app_settings.CACHE_TIMEOUT)
+    return recipient_ids
+
+
+def create_notifications(**kwargs):
+    """
+    Creates notifications for the arguments received from the notify signal.
+    """
+    # Pull the options out of kwargs
     actor = kwargs.pop("sender")
     public = bool(kwargs.pop("public", True))
     description = kwargs.pop("description", None)
@@ -83,39 +219,6 @@ def notify_handler(**kwargs):
         where = where | (Q(is_staff=True) & org_admin_query)
         where_group = org_admin_query
 
-        # Notification preference resolution:
-        # user setting -> org setting -> type default.
-        #
-        # Users with web=None are included only when the fallback
-        # chain can still resolve to True. Org-level web settings
-        # are resolved via JOINs in the main query to avoid an
-        # additional OrganizationNotificationSettings lookup.
-        web_notification = Q(notificationsetting__web=True)
-        if notification_template["web_notification"]:
-            inherit_org_web = Q(
-                notificationsetting__organization__notification_settings__web=True
-            )
-            if app_settings.WEB_ENABLED:
-                inherit_org_web |= Q(
-                    notificationsetting__organization__notification_settings__web=None
-                ) | Q(
-                    notificationsetting__organization__notification_settings__isnull=True
-                )
-            web_notification |= (
-                Q(
-                    notificationsetting__web=None,
-                )
-                & inherit_org_web
-            )
-
-        notification_setting = web_notification & Q(
-            notificationsetting__type=notification_type,
-            notificationsetting__organization_id=target_org,
-            notificationsetting__deleted=False,
-        )
-        where = where & notification_setting
-        where_group = where_group & notification_setting
-
     # Ensure notifications are only sent to active user
     where = where & Q(is_active=True)
     where_group = where_group & Q(is_active=True)
@@ -143,55 +246,199 @@ def notify_handler(**kwargs):
         else:
             recipients = [recipient]
     else:
+        recipient_ids = get_eligible_recipient_ids(
+            where, target_org, notification_type, notification_template
+        )
+        # Only the exclusion of ignored objects is evaluated on each call
         recipients = (
-            User.objects.prefetch_related(
-                "notificationsetting_set", "ignoreobjectnotification_set"
-            )
+            User.objects.only(*RECIPIENT_FIELDS)
             .order_by("date_joined")
-            .filter(where)
+            .filter(pk__in=recipient_ids)
             .exclude(not_where)
             .distinct()
         )
+    if target_org and isinstance(recipient, Group):
+        recipients = list(recipients.only(*RECIPIENT_FIELDS))
+        preferences = NotificationSetting.get_effective_preferences(
+            [user.pk for user in recipients], target_org, notification_type
+        )
+        recipients = [user for user in recipients if preferences[str(user.pk)][0]]
     optional_objs = [
         (kwargs.pop(opt, None), opt) for opt in ("target", "action_object")
     ]
-    target_url_suffix = kwargs.get("target_url_suffix")
-    if target_url_suffix is not None and (
-        not isinstance(target_url_suffix, str)
-        or not target_url_suffix.startswith(("?", "&", "#"))
-    ):
-        raise ValueError(
-            _("target_url_suffix must be a string starting with '?', '&' or '#'.")
-        )
+    _validate_target_url_suffix(kwargs.get("target_url_suffix"))
+
+    aggregation_window = None
+    if target is not None:
+        aggregation_window = notification_template.get("aggregation_window")
 
     notification_list = []
+    validated = False
+    for chunk in _iter_recipient_chunks(recipients):
+        if aggregation_window:
+            aggregated, chunk = aggregate_notifications(
+                chunk, notification_type, target, timestamp, aggregation_window
+            )
+            notification_list.extend(aggregated)
+            if not chunk:
+                continue
+        email_recipients = get_email_notification_recipients(
+            chunk, notification_type, target_org
+        )
+        batch = []
+        for recipient in chunk:
+            notification = Notification(
+                recipient=recipient,
+                actor=actor,
+                verb=str(verb),
+                public=public,
+                description=description,
+                timestamp=timestamp,
+                level=level,
+                type=notification_type,
+            )
+
+            # Set optional objects
+            for obj, opt in optional_objs:
+                if obj is not None:
+                    setattr(notification, "%s_object_id" % opt, obj.pk)
+                    setattr(
+                        notification,
+                        "%s_content_type" % opt,
+                        ContentType.objects.get_for_model(obj),
+                    )
+            if kwargs:
+                notification.data = kwargs
+            # Email preference resolved in bulk, see dispatch_email_notification
+            notification._email_enabled = recipient.pk in email_recipients
+            if not app_settings.BULK_CREATE:
+                notification.save()
+            batch.append(notification)
+        if app_settings.BULK_CREATE:
+            bulk_create_notifications(batch)
+        if not validated:
+            validated = True
+            if not delete_malformed_notifications(batch):
+                # The remaining recipients would receive
+                # the same malformed notification
+                notification_list.extend(batch)
+                return notification_list
+        if aggregation_window:
+            cache.set_many(
+                {
+                    Notification.aggregation_cache_key(
+                        notification.recipient_id,
+                        notification_type,
+                        notification.target_content_type_id,
+                        notification.target_object_id,
+                    ): str(notification.pk)
+                    for notification in batch
+                },
+                timeout=aggregation_window,
+            )
+        notification_list.extend(batch)
+    return notification_list
+
+
+def aggregate_notifications(
+    recipients, notification_type, target, timestamp, aggregation_window
+):
+    """
+    Aggregates a repeated notification into the unread notification of
+    the same type and target received by each of ``recipients`` in the
+    last ``aggregation_window`` seconds: its ``aggregated_count`` is
+    incremented and its timestamp is updated. The ``data`` and
+    ``description`` of the repeated events are discarded.
+
+    Returns the aggregated notifications and the recipients
+    which have to receive a new notification.
+    """
+    target_content_type = ContentType.objects.get_for_model(target)
+    cache_keys = {
+        Notification.aggregation_cache_key(
+            recipient.pk, notification_type, target_content_type.pk, target.pk
+        ): recipient
+        for recipient in recipients
+    }
+    cached = cache.get_many(cache_keys)
+    if not cached:
+        return [], recipients
+    notifications = list(
+        Notification.objects.filter(pk__in=cached.values(), unread=True).only(
+            "pk", "recipient_id", "unread", "data", "timestamp"
+        )
+    )
+    for notification in notifications:
+        data = notification.data or {}
+        data["aggregated_count"] = data.get("aggregated_count", 1) + 1
+        notification.data = data
+        notification.timestamp = timestamp
+    Notification.objects.bulk_update(notifications, ["data", "timestamp"])
+    aggregated = {str(notification.pk) for notification in notifications}
+    # Repeated events keep the aggregation window open
+    cache.set_many(
+        {key: pk for key, pk in cached.items() if pk in aggregated},
+        timeout=aggregation_window,
+    )
+    aggregated_recipients = {
+        notification.recipient_id: notification for notification in notifications
+    }
+    new_recipients = []
     for recipient in recipients:
-        notification = Notification(
+        notification = aggregated_recipients.get(recipient.pk)
+        if notification is None:
+            new_recipients.append(recipient)
+            continue
+        # "bulk_update" does not send "post_save", the widget is
+        # reloaded to move the aggregated notification to the top
+        ws_handlers.notification_update_handler(
+            reload_widget=True,
             recipient=recipient,
-            actor=actor,
-            verb=str(verb),
-            public=public,
-            description=description,
-            timestamp=timestamp,
-            level=level,
-            type=notification_type,
+            update=ws_handlers.get_notification_update(notification, "updated"),
         )
+    return notifications, new_recipients
 
-        # Set optional objects
-        for obj, opt in optional_objs:
-            if obj is not None:
-                setattr(notification, "%s_object_id" % opt, obj.pk)
-                setattr(
-                    notification,
-                    "%s_content_type" % opt,
-                    ContentType.objects.get_for_model(obj),
-                )
-        if kwargs:
-            notification.data = kwargs
-        notification.save()
-        notification_list.append(notification)
 
-    return notification_list
+def _iter_recipient_chunks(recipients):
+    """
+    Yields the recipients in lists of at most ``RECIPIENTS_CHUNK_SIZE``
+    users, querysets are streamed from the database.
+    """
+    chunk_size = app_settings.RECIPIENTS_CHUNK_SIZE
+    if isinstance(recipients, QuerySet):
+        recipients = recipients.iterator(chunk_size=chunk_size)
+    chunk = []
+    for recipient in recipients:
+        chunk.append(recipient)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def bulk_create_notifications(notifications):
+    """
+    Creates notifications with ``bulk_create`` and runs the side effects
+    of the ``post_save`` receivers of the Notification model (email
+    dispatch, unread counters and websocket push) as batched
+    passes over each chunk of created notifications.
+    """
+    batch_size = app_settings.BULK_CREATE_BATCH_SIZE
+    for start in range(0, len(notifications), batch_size):
+        end = start + batch_size
+        batch = notifications[start:end]
+        Notification.objects.bulk_create(batch)
+        for notification in batch:
+            dispatch_email_notification(notification)
+        unread_deltas = {}
+        for notification in batch:
+            unread_deltas[notification.recipient_id] = unread_deltas.get(
+                notification.recipient_id, 0
+            ) + int(notification.unread)
+        Notification.update_unread_counts(unread_deltas)
+        ws_handlers.record_notification_timestamps(batch)
+        ws_handlers.notifications_update_handler(batch)
 
 
 @receiver(post_save, sender=Notification, dispatch_uid="send_email_notification")
@@ -199,11 +446,20 @@ def send_email_notification(sender, instance, created, **kwargs):
     # Abort if a new notification is not created
     if not created:
         return
+    dispatch_email_notification(instance)
 
-    email_verified = instance.recipient.emailaddress_set.filter(
-        verified=True, email=instance.recipient.email
-    ).exists()
-    if not email_verified or not get_user_email_preference(instance):
+
+def dispatch_email_notification(instance):
+    """
+    Sends the email for a newly created notification, or adds it
+    to the email batch of the recipient.
+    """
+    email_enabled = getattr(instance, "_email_enabled", None)
+    if email_enabled is None:
+        email_enabled = instance.recipient.emailaddress_set.filter(
+            verified=True, email=instance.recipient.email
+        ).exists() and get_user_email_preference(instance)
+    if not email_enabled:
         return
     if not app_settings.EMAIL_BATCH_INTERVAL:
         instance.send_email()
@@ -261,31 +517,124 @@ def send_email_notification(sender, instance, created, **kwargs):
     post_delete, sender=Notification, dispatch_uid="clear_notification_cache_deleted"
 )
 def clear_notification_cache(sender, instance, **kwargs):
-    Notification.invalidate_unread_cache(instance.recipient)
-    # Reload notification widget only if notification is created or deleted
-    # Display notification toast when a new notification is created
+    if kwargs.get("created"):
+        action = "created"
+        Notification.update_unread_counts({instance.recipient_id: int(instance.unread)})
+        ws_handlers.record_notification_timestamps([instance])
+    elif kwargs["signal"] is post_delete:
+        action = "deleted"
+        Notification.update_unread_counts(
+            {instance.recipient_id: -int(instance.unread)}
+        )
+        ws_handlers.discard_notification_timestamps([instance.recipient_id])
+    elif getattr(instance, "_marked_as_read", False):
+        action = "updated"
+        instance._marked_as_read = False
+        Notification.update_unread_counts({instance.recipient_id: -1})
+    else:
+        action = "updated"
+        # The previous value of "unread" is unknown
+        Notification.invalidate_unread_cache(instance.recipient)
+    # The notification widget is updated in place by the clients,
+    # the toast is displayed when a new notification is created
     ws_handlers.notification_update_handler(
         recipient=instance.recipient,
-        reload_widget=kwargs.get("created", True),
-        notification=instance if kwargs.get("created", None) else None,
+        notification=instance if action == "created" else None,
+        update=ws_handlers.get_notification_update(instance, action),
     )
 
 
-@receiver(post_delete, dispatch_uid="delete_obsolete_objects")
-def related_object_deleted(sender, instance, **kwargs):
+def delete_malformed_notifications(notifications):
+    """
+    Renders the message of the first of ``notifications``, which are
+    created by the same ``notify`` call and share their type and related
+    objects. If it cannot be rendered, all the ``notifications`` are
+    deleted, even if their recipients are not online, and an empty
+    list is returned.
+    """
+    try:
+        notifications[0].message
+    except NotificationRenderException:
+        Notification.objects.filter(
+            pk__in=[notification.pk for notification in notifications]
+        ).delete()
+        return []
+    return notifications
+
+
+def related_object_deleted(sender, instance, using=None, **kwargs):
     """
     Delete Notification and IgnoreObjectNotification objects having
     "instance" as related object.
+
+    Deletions happening in a transaction are buffered and cleaned
+    up in one task per model and atomic block when it is committed.
     """
     if sender not in NOTIFICATION_ASSOCIATED_MODELS:
         return
     instance_id = getattr(instance, "pk", None)
-    if instance_id:
-        instance_model = instance._meta.model_name
-        instance_app_label = instance._meta.app_label
+    if not instance_id:
+        return
+    instance_model = instance._meta.model_name
+    instance_app_label = instance._meta.app_label
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
         tasks.delete_obsolete_objects.delay(
             instance_app_label, instance_model, instance_id
         )
+        return
+    # Deletions are buffered per atomic block, hence the deletions of a
+    # rolled back savepoint are discarded together with its callback
+    key = (connection.alias, *filter(None, connection.savepoint_ids))
+    buffers = getattr(_obsolete_objects, "buffers", None)
+    if buffers is None:
+        buffers = _obsolete_objects.buffers = weakref.WeakValueDictionary()
+    obsolete_objects = buffers.get(key)
+    if obsolete_objects is None:
+        # The buffer is referenced only by its pending callback, therefore
+        # it is dropped as soon as the callback is executed or discarded
+        obsolete_objects = buffers[key] = _ObsoleteObjects()
+        transaction.on_commit(obsolete_objects, using=connection.alias, robust=True)
+    obsolete_objects.setdefault((instance_app_label, instance_model), []).append(
+        str(instance_id)
+    )
+
+
+_obsolete_objects = threading.local()
+
+
+class _ObsoleteObjects(dict):
+    """
+    Related objects deleted in an atomic block, which are
+    cleaned up in one task per model when it is committed.
+    """
+
+    def __call__(self):
+        for (instance_app_label, instance_model), instance_ids in self.items():
+            if len(instance_ids) == 1:
+                tasks.delete_obsolete_objects.delay(
+                    instance_app_label, instance_model, instance_ids[0]
+                )
+                continue
+            tasks.delete_obsolete_objects_batch.delay(
+                [
+                    (instance_app_label, instance_model, instance_id)
+                    for instance_id in instance_ids
+                ]
+            )
+
+
+def connect_related_object_deleted(models):
+    """
+    Connects the ``post_delete`` signal of ``models``, which are the
+    models associated to notification types, to ``related_object_deleted``.
+    """
+    for model in models:
+        post_delete.connect(
+            related_object_deleted,
+            sender=model,
+            dispatch_uid="delete_obsolete_objects",
+        )
 
 
 @receiver(
@@ -299,9 +648,46 @@ def create_org_notification_settings(created, instance, **kwargs):
     org_setting.save()
 
 
+@receiver(
+    post_save,
+    sender=NotificationSetting,
+    dispatch_uid="notification_setting_preference_cache_saved",
+)
+@receiver(
+    post_delete,
+    sender=NotificationSetting,
+    dispatch_uid="notification_setting_preference_cache_deleted",
+)
+@receiver(
+    post_save,
+    sender=OrganizationNotificationSettings,
+    dispatch_uid="org_notification_settings_preference_cache_saved",
+)
+@receiver(
+    post_delete,
+    sender=OrganizationNotificationSettings,
+    dispatch_uid="org_notification_settings_preference_cache_deleted",
+)
+def invalidate_preference_cache(instance, **kwargs):
+    # Global notification settings affect every organization of the user
+    NotificationSetting.invalidate_preference_cache(instance.organization_id)
+
+
 def notification_type_registered_unregistered_handler(sender, **kwargs):
+    populated_types = types.get_populated_notification_types()
+    task_kwargs = {}
+    if populated_types is not None and tasks.notification_settings_populated(
+        populated_types
+    ):
+        if not types.notification_types_changed():
+            # No notification type has been registered or
+            # unregistered since the last successful run
+            return
+        task_kwargs["notification_types"] = sorted(
+            set(types.NOTIFICATION_TYPES) - set(populated_types)
+        )
     try:
-        tasks.ns_register_unregister_notification_type.delay()
+        tasks.ns_register_unregister_notification_type.delay(**task_kwargs)
     except OperationalError:
         logger.warn(
             "\tCelery broker is unreachable, skipping populating data for user(s) "
@@ -319,6 +705,7 @@ def notification_type_registered_unregistered_handler(sender, **kwargs):
     dispatch_uid="create_orguser_notification_setting",
 )
 def organization_user_post_save(instance, created, **kwargs):
+    invalidate_recipients_cache(instance.organization_id)
     transaction.on_commit(
         lambda: tasks.update_org_user_notificationsetting.delay(
             org_user_id=instance.pk,
@@ -335,6 +722,7 @@ def organization_user_post_save(instance, created, **kwargs):
     dispatch_uid="delete_orguser_notification_setting",
 )
 def notification_setting_delete_org_user(instance, **kwargs):
+    invalidate_recipients_cache(instance.organization_id)
     tasks.ns_organization_user_deleted.delay(
         user_id=instance.user_id, org_id=instance.organization_id
     )
@@ -348,16 +736,31 @@ def superuser_status_changed_notification_setting(instance, update_fields, **kwa
     """
     instance._lost_privileges = False
     instance._gained_privileges = False
-    if update_fields is not None and not {"is_superuser", "is_staff"}.intersection(
-        update_fields
-    ):
+    instance._recipient_status_changed = False
+    if update_fields is not None and not {
+        "is_superuser",
+        "is_staff",
+        "is_active",
+    }.intersection(update_fields):
         # No-op if relevant privilege fields are not being updated.
         return
     try:
-        db_instance = User.objects.only("is_superuser", "is_staff").get(pk=instance.pk)
+        db_instance = User.objects.only("is_superuser", "is_staff", "is_active").get(
+            pk=instance.pk
+        )
     except User.DoesNotExist:
         # User is being created
         return
+    # Flag read by the post_save handler to invalidate the cached recipients.
+    instance._recipient_status_changed = (
+        db_instance.is_superuser != instance.is_superuser
+        or db_instance.is_staff != instance.is_staff
+        or db_instance.is_active != instance.is_active
+    )
+    if update_fields is not None and not {"is_superuser", "is_staff"}.intersection(
+        update_fields
+    ):
+        return
     was_privileged = db_instance.is_superuser or db_instance.is_staff
     is_now_privileged = instance.is_superuser or instance.is_staff
     gained_superuser = not db_instance.is_superuser and instance.is_superuser
@@ -377,10 +780,14 @@ def create_superuser_notification_settings(instance, created, **kwargs):
     This works on either staff users or super users.
     """
     if created and (instance.is_superuser or instance.is_staff):
+        invalidate_recipients_cache()
         transaction.on_commit(
             lambda: tasks.create_superuser_notification_settings.delay(instance.pk)
         )
     elif not created:
+        if getattr(instance, "_recipient_status_changed", False):
+            instance._recipient_status_changed = False
+            invalidate_recipients_cache()
         lost_privileges = getattr(instance, "_lost_privileges", False)
         gained_privileges = getattr(instance, "_gained_privileges", False)
         instance._lost_privileges = False
@@ -400,7 +807,22 @@ def create_superuser_notification_settings(instance, created, **kwargs):
 )
 def notification_setting_org_created(created, instance, **kwargs):
     if created:
-        transaction.on_commit(lambda: tasks.ns_organization_created.delay(instance.pk))
+        transaction.on_commit(schedule_ns_organization_created)
+
+
+ORGANIZATION_CREATED_COUNTDOWN = 5
+
+
+def schedule_ns_organization_created():
+    # Organizations created in a burst are processed by one task run
+    if cache.add(
+        tasks.ORGANIZATION_CREATED_LOCK_KEY,
+        True,
+        timeout=ORGANIZATION_CREATED_COUNTDOWN * 12,
+    ):
+        tasks.ns_organization_created.apply_async(
+            countdown=ORGANIZATION_CREATED_COUNTDOWN
+        )
 
 
 @receiver(
@@ -428,6 +850,7 @@ def update_notification_cache(sender, instance, **kwargs):
         content_type = ContentType.objects.get_for_model(instance)
         cache_key = Notification._cache_key(content_type.id, instance.id)
         cache.delete(cache_key)
+        Notification.invalidate_render_cache(content_type.id, instance.id)
 
     # execute cache invalidation only after changes have been committed to the DB
     transaction.on_commit(invalidate_cache)
@@ -1,8 +1,8 @@
-from django.core.management.base import BaseCommand
+import time
 
-from openwisp_notifications.handlers import (
-    notification_type_registered_unregistered_handler,
-)
+from django.core.management.base import BaseCommand, CommandError
+
+from openwisp_notifications import tasks, types
 from openwisp_notifications.signals import notify
 from openwisp_notifications.swapper import swapper_load_model
 
@@ -17,5 +17,68 @@ class BaseCreateNotificationCommand(BaseCommand):
 
 
 class BasePopulateNotificationPreferencesCommand(BaseCommand):
-    def handle(self, *args, **kwargs):
-        notification_type_registered_unregistered_handler(self)
+    help = "Populates notification preferences of users"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--types",
+            nargs="+",
+            metavar="TYPE",
+            help="Populate only the specified notification types",
+        )
+        parser.add_argument(
+            "--orgs",
+            nargs="+",
+            metavar="SLUG",
+            help="Populate only the organizations with the specified slugs",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report the number of preferences which would be changed",
+        )
+
+    def handle(self, *args, **options):
+        notification_types = options["types"]
+        if notification_types:
+            unregistered = set(notification_types) - set(types.NOTIFICATION_TYPES)
+            if unregistered:
+                raise CommandError(
+                    "Unregistered notification type(s): "
+                    + ", ".join(sorted(unregistered))
+                )
+        organizations = None
+        if options["orgs"]:
+            organizations = Organization.objects.filter(slug__in=options["orgs"])
+            missing = set(options["orgs"]) - set(
+                organizations.values_list("slug", flat=True)
+            )
+            if missing:
+                raise CommandError(
+                    "Organization(s) not found: " + ", ".join(sorted(missing))
+                )
+        self._users = self._changed = 0
+        self._start = time.monotonic()
+        changed = tasks.populate_notification_settings(
+            notification_types=notification_types,
+            organizations=organizations,
+            # Notification types are unregistered globally, hence
+            # restricted runs must not delete anything
+            delete_unregistered=not (notification_types or organizations),
+            dry_run=options["dry_run"],
+            progress=self._progress,
+        )
+        verb = "would be created or revived" if options["dry_run"] else "populated"
+        self.stdout.write(
+            f"{changed} notification preference(s) {verb} "
+            f"in {time.monotonic() - self._start:.2f}s"
+        )
+
+    def _progress(self, users, changed):
+        self._users += users
+        self._changed += changed
+        elapsed = max(time.monotonic() - self._start, 1e-6)
+        self.stdout.write(
+            f"Processed {self._users} user(s), {self._changed} preference(s) "
+            f"changed ({self._users / elapsed:.0f} users/s)"
+        )
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("openwisp_notifications", "0017_add_global_notification_setting_constraint"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["actor_content_type", "actor_object_id"],
+                name="openwisp_no_actor_c_a1b5e9_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["action_object_content_type", "action_object_object_id"],
+                name="openwisp_no_action__b6e48c_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["target_content_type", "target_object_id"],
+                name="openwisp_no_target__71f63a_idx",
+            ),
+        ),
+    ]
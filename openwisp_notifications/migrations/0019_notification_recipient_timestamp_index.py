@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("openwisp_notifications", "0018_notification_related_object_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["recipient", "timestamp"],
+                name="openwisp_no_recipie_cd8fe7_idx",
+            ),
+        ),
+    ]
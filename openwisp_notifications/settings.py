@@ -43,6 +43,17 @@ WEB_ENABLED = get_setting("WEB_ENABLED", True)
 EMAIL_ENABLED = get_setting("EMAIL_ENABLED", True)
 EMAIL_BATCH_INTERVAL = get_setting("EMAIL_BATCH_INTERVAL", 180 * 60)  # 3 hours
 EMAIL_BATCH_DISPLAY_LIMIT = get_setting("EMAIL_BATCH_DISPLAY_LIMIT", 15)
+ASYNC_NOTIFY = get_setting("ASYNC_NOTIFY", False)
+BULK_CREATE = get_setting("BULK_CREATE", False)
+BULK_CREATE_BATCH_SIZE = get_setting("BULK_CREATE_BATCH_SIZE", 500)
+RECIPIENTS_CHUNK_SIZE = get_setting("RECIPIENTS_CHUNK_SIZE", 500)
+DELETE_OLD_NOTIFICATIONS_BATCH_SIZE = get_setting(
+    "DELETE_OLD_NOTIFICATIONS_BATCH_SIZE", 1000
+)
+DELETE_OLD_NOTIFICATIONS_SLEEP = get_setting("DELETE_OLD_NOTIFICATIONS_SLEEP", 0)
+POPULATE_PREFERENCES_SHARD_SIZE = get_setting("POPULATE_PREFERENCES_SHARD_SIZE", 50)
+RENDER_CACHE_SIZE = get_setting("RENDER_CACHE_SIZE", 1000)
+PRESENCE_REGISTRY = get_setting("PRESENCE_REGISTRY", False)
 
 
 # Remove the leading "/static/" here as it will
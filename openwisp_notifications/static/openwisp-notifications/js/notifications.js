@@ -2,6 +2,9 @@
 const notificationReadStatus = new Map();
 const userLanguage = navigator.language || navigator.userLanguage;
 const owWindowId = String(Date.now());
+// Timestamp of the most recent notification received by the window,
+// it is kept across page reloads in the session storage.
+const lastSeenStorageKey = "owNotificationLastSeen";
 let fetchedPages = [];
 
 if (typeof gettext === "undefined") {
@@ -147,8 +150,14 @@ function convertMessageWithRelativeURL(htmlString) {
   return doc.body.innerHTML;
 }
 
+// Cursor pagination avoids counting all the notifications
+// and the slow OFFSET queries of deep pages
+const notificationListUrl = "/api/v1/notifications/notification/?pagination=cursor";
+
 function notificationWidget($) {
-  let nextPageUrl = getAbsoluteUrl("/api/v1/notifications/notification/"),
+  let nextPageUrl = getAbsoluteUrl(notificationListUrl),
+    listUrl = notificationListUrl,
+    unreadFilter = false,
     renderedPages = 2,
     busy = false,
     lastRenderedPage = 0;
@@ -189,7 +198,7 @@ function notificationWidget($) {
       },
       success: function (res) {
         nextPageUrl = res.next;
-        if (res.count === 0 || (res.results.length === 0 && nextPageUrl === null)) {
+        if (res.results.length === 0 && nextPageUrl === null) {
           // If response does not have any notification, show no-notifications message.
           $(".ow-no-notifications").removeClass("ow-hide");
           $("#ow-mark-all-read").addClass("disabled");
@@ -199,6 +208,7 @@ function notificationWidget($) {
             fetchNextPage();
           }
           fetchedPages.push(res.results);
+          updateLastSeen(res.results[0]);
           appendPage();
           // Enable filters
           $(".toggle-btn").removeClass("disabled");
@@ -291,18 +301,77 @@ function notificationWidget($) {
     $(".ow-notifications").off("click", initNotificationWidget);
   }
 
-  function refreshNotificationWidget(
-    e = null,
-    url = "/api/v1/notifications/notification/",
-  ) {
+  function refreshNotificationWidget(e = null, url = notificationListUrl) {
     $(".ow-notification-wrapper > div").remove(".page");
     fetchedPages.length = 0;
     lastRenderedPage = 0;
+    listUrl = url;
     nextPageUrl = getAbsoluteUrl(url);
+    // Notifications received through the websocket
+    // have to match the filter of the rendered list
+    const unread = new URL(nextPageUrl).searchParams.get("unread");
+    unreadFilter = ["true", "1"].includes(String(unread).toLowerCase());
     notificationReadStatus.clear();
     onUpdate();
   }
 
+  function prependNotifications(e, notifications) {
+    if (fetchedPages.length === 0) {
+      // The widget is loaded when it is opened for the first time,
+      // it is reloaded only if it was showing no notifications
+      if (nextPageUrl === null) {
+        $(".ow-notification-wrapper").trigger("refreshNotificationWidget", [listUrl]);
+      }
+      return;
+    }
+    // Skip notifications which have already been fetched
+    // or which do not match the unread filter
+    const fetchedIds = new Set(fetchedPages.flat().map((elem) => elem.id));
+    notifications = notifications.filter(
+      (elem) => !fetchedIds.has(elem.id) && (!unreadFilter || elem.unread),
+    );
+    if (notifications.length === 0) {
+      return;
+    }
+    fetchedPages[0] = notifications.concat(fetchedPages[0]);
+    // The first page is rendered only if the user has not scrolled down
+    if (lastRenderedPage <= renderedPages) {
+      $(".ow-notification-wrapper div.page:first").prepend(
+        notifications.map(notificationListItem).join(""),
+      );
+    }
+  }
+
+  function applyNotificationUpdate(e, update, notification) {
+    // Updates the widget in place with the changes received
+    // through the websocket
+    if (update.action === "created") {
+      if (notification) {
+        prependNotifications(e, [notification]);
+      }
+      return;
+    }
+    fetchedPages.forEach(function (page) {
+      const index = page.findIndex((elem) => elem.id === update.id);
+      if (index === -1) {
+        return;
+      }
+      if (update.action === "deleted") {
+        page.splice(index, 1);
+      } else {
+        page[index].unread = update.unread;
+      }
+    });
+    const elem = $(`#ow-${update.id}.ow-notification-elem`);
+    if (update.action === "deleted") {
+      notificationReadStatus.delete(update.id);
+      elem.remove();
+    } else {
+      notificationReadStatus.set(update.id, update.unread ? "unread" : "read");
+      elem.toggleClass("unread", update.unread);
+    }
+  }
+
   function showNotificationDropdownError(message) {
     $("#ow-notification-dropdown-error").html(message);
     $("#ow-notification-dropdown-error-container").slideDown(1000);
@@ -389,6 +458,51 @@ function notificationWidget($) {
     "refreshNotificationWidget",
     refreshNotificationWidget,
   );
+  $(".ow-notification-wrapper").bind("prependNotifications", prependNotifications);
+  $(".ow-notification-wrapper").bind(
+    "applyNotificationUpdate",
+    applyNotificationUpdate,
+  );
+}
+
+function updateLastSeen(notification) {
+  if (!notification) {
+    return;
+  }
+  let lastSeen = sessionStorage.getItem(lastSeenStorageKey);
+  if (lastSeen === null || new Date(notification.timestamp) > new Date(lastSeen)) {
+    sessionStorage.setItem(lastSeenStorageKey, notification.timestamp);
+  }
+}
+
+function sendLastSeen() {
+  // Asks the server for the notifications missed while the
+  // websocket was disconnected (e.g. during page reloads)
+  let lastSeen = sessionStorage.getItem(lastSeenStorageKey);
+  if (lastSeen !== null) {
+    notificationSocket.send(
+      JSON.stringify({
+        type: "last_seen",
+        last_seen: lastSeen,
+      }),
+    );
+  }
+}
+
+function updateNotificationCount($, notificationCount) {
+  let countTag = $("#ow-notification-count");
+  if (notificationCount === 0) {
+    countTag.remove();
+  } else {
+    // If unread tag is not present than insert it.
+    // Otherwise, update innerHTML.
+    if (countTag.length === 0) {
+      let html = `<span id="ow-notification-count">${notificationCount}</span>`;
+      $(".ow-notifications").append(html);
+    } else {
+      countTag.html(notificationCount);
+    }
+  }
 }
 
 function markNotificationRead(elem) {
@@ -456,29 +570,40 @@ function notificationHandler($, elem) {
 }
 
 function initWebSockets($) {
+  if (notificationSocket.readyState === 1) {
+    sendLastSeen();
+  }
+  notificationSocket.addEventListener("open", sendLastSeen);
   notificationSocket.addEventListener("message", function (e) {
     let data = JSON.parse(e.data);
+    if (data.type === "missed_notifications") {
+      updateNotificationCount($, data.notification_count);
+      if (data.reload_widget) {
+        $(".ow-notification-wrapper").trigger("refreshNotificationWidget");
+      } else if (data.notifications.length) {
+        updateLastSeen(data.notifications[0]);
+        $(".ow-notification-wrapper").trigger("prependNotifications", [
+          data.notifications,
+        ]);
+      }
+      return;
+    }
     if (data.type !== "notification") {
       return;
     }
 
     // Update notification count
-    let countTag = $("#ow-notification-count");
-    if (data.notification_count === 0) {
-      countTag.remove();
-    } else {
-      // If unread tag is not present than insert it.
-      // Otherwise, update innerHTML.
-      if (countTag.length === 0) {
-        let html = `<span id="ow-notification-count">${data.notification_count}</span>`;
-        $(".ow-notifications").append(html);
-      } else {
-        countTag.html(data.notification_count);
-      }
-    }
-    // Check whether to update notification widget
+    updateNotificationCount($, data.notification_count);
+    updateLastSeen(data.notification);
+    // Check whether to reload notification widget, otherwise
+    // the changes are applied to the widget in place
     if (data.reload_widget) {
       $(".ow-notification-wrapper").trigger("refreshNotificationWidget");
+    } else if (data.update) {
+      $(".ow-notification-wrapper").trigger("applyNotificationUpdate", [
+        data.update,
+        data.notification,
+      ]);
     }
     // Check whether to display notification toast
     if (data.notification) {
@@ -1,13 +1,18 @@
 import logging
+import time
 from datetime import timedelta
+from uuid import uuid4
 
-from celery import shared_task
+from celery import group, shared_task
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import Count, Q, QuerySet
 from django.db.utils import OperationalError
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from openwisp_notifications import settings as app_settings
 from openwisp_notifications import types
@@ -23,10 +28,32 @@ Notification = load_model("Notification")
 NotificationSetting = load_model("NotificationSetting")
 IgnoreObjectNotification = load_model("IgnoreObjectNotification")
 
+Group = swapper_load_model("openwisp_users", "Group")
 Organization = swapper_load_model("openwisp_users", "Organization")
 OrganizationUser = swapper_load_model("openwisp_users", "OrganizationUser")
 
 
+def _delete_obsolete_objects(content_type, instance_ids):
+    instance_ids = [str(instance_id) for instance_id in instance_ids]
+    # One query for each generic relation, each one can use the
+    # index on the (content_type, object_id) pair of the relation
+    for field in ("actor", "action_object", "target"):
+        Notification.objects.filter(
+            **{
+                f"{field}_content_type": content_type,
+                f"{field}_object_id__in": instance_ids,
+            }
+        ).delete()
+    # Delete IgnoreObjectNotification objects
+    try:
+        IgnoreObjectNotification.objects.filter(
+            object_id__in=instance_ids, object_content_type_id=content_type.pk
+        ).delete()
+    except OperationalError:
+        # Raised when an object is deleted in migration
+        return
+
+
 @shared_task(base=OpenwispCeleryTask)
 def delete_obsolete_objects(instance_app_label, instance_model, instance_id):
     """
@@ -39,28 +66,81 @@ def delete_obsolete_objects(instance_app_label, instance_model, instance_id):
         )
     except ContentType.DoesNotExist:
         return
-    else:
-        # Delete Notification objects
-        where = (
-            Q(actor_content_type=instance_content_type)
-            | Q(action_object_content_type=instance_content_type)
-            | Q(target_content_type=instance_content_type)
-        )
-        where = where & (
-            Q(actor_object_id=instance_id)
-            | Q(action_object_object_id=instance_id)
-            | Q(target_object_id=instance_id)
-        )
-        Notification.objects.filter(where).delete()
+    _delete_obsolete_objects(instance_content_type, [instance_id])
 
-        # Delete IgnoreObjectNotification objects
+
+@shared_task(base=OpenwispCeleryTask)
+def delete_obsolete_objects_batch(objects, batch_size=1000):
+    """
+    Batched variant of ``delete_obsolete_objects``, ``objects`` is a
+    list of ``(app_label, model, instance_id)`` triplets.
+    """
+    instance_ids = {}
+    for instance_app_label, instance_model, instance_id in objects:
+        instance_ids.setdefault((instance_app_label, instance_model), []).append(
+            instance_id
+        )
+    for (instance_app_label, instance_model), ids in instance_ids.items():
         try:
-            IgnoreObjectNotification.objects.filter(
-                object_id=instance_id, object_content_type_id=instance_content_type.pk
-            ).delete()
-        except OperationalError:
-            # Raised when an object is deleted in migration
-            return
+            instance_content_type = ContentType.objects.get_by_natural_key(
+                instance_app_label, instance_model
+            )
+        except ContentType.DoesNotExist:
+            continue
+        for chunk in _chunks(ids, batch_size):
+            _delete_obsolete_objects(instance_content_type, chunk)
+
+
+def _load_object(value):
+    if value is None:
+        return None
+    content_type_id, object_id = value
+    return ContentType.objects.get_for_id(content_type_id).get_object_for_this_type(
+        pk=object_id
+    )
+
+
+def _load_recipient(value):
+    if not value:
+        return None
+    if "group" in value:
+        return Group.objects.get(pk=value["group"])
+    return User.objects.filter(pk__in=value["users"])
+
+
+@shared_task(base=OpenwispCeleryTask)
+def notify_async(
+    actor, recipient=None, target=None, action_object=None, timestamp=None, **kwargs
+):
+    """
+    Creates notifications for the arguments of a notify signal
+    serialized by "openwisp_notifications.handlers.schedule_notification".
+    """
+    from openwisp_notifications.handlers import create_notifications
+
+    try:
+        actor = _load_object(actor)
+        target = _load_object(target)
+        action_object = _load_object(action_object)
+        recipient = _load_recipient(recipient)
+    except ObjectDoesNotExist as error:
+        logger.warning(f"Skipping notification, related object not found: {error}")
+        return
+    # Explicit recipients which have all been deleted must not fall back
+    # to the default recipients (superusers and organization admins)
+    if isinstance(recipient, QuerySet) and not recipient.exists():
+        logger.warning("Skipping notification, recipients not found")
+        return
+    if target is not None:
+        kwargs["target"] = target
+    if action_object is not None:
+        kwargs["action_object"] = action_object
+    create_notifications(
+        sender=actor,
+        recipient=recipient,
+        timestamp=parse_datetime(timestamp) if timestamp else timezone.now(),
+        **kwargs,
+    )
 
 
 @shared_task(base=OpenwispCeleryTask)
@@ -68,14 +148,127 @@ def delete_notification(notification_id):
     Notification.objects.filter(pk=notification_id).delete()
 
 
+DELETE_OLD_NOTIFICATIONS_PROGRESS_KEY = "ow-notifications-delete-old-progress"
+
+
+def _delete_notifications_batch(pks, raw=False):
+    batch = Notification.objects.filter(pk__in=pks)
+    if not raw:
+        deleted, _ = batch.delete()
+        return deleted
+    # Raw deletion does not send post_delete signals,
+    # hence the unread counters are updated here.
+    unread_counts = dict(
+        batch.filter(unread=True)
+        .values("recipient_id")
+        .annotate(unread_count=Count("id"))
+        .values_list("recipient_id", "unread_count")
+    )
+    deleted = batch._raw_delete(batch.db)
+    transaction.on_commit(
+        lambda: Notification.update_unread_counts(
+            {user_id: -count for user_id, count in unread_counts.items()}
+        )
+    )
+    return deleted
+
+
 @shared_task
-def delete_old_notifications(days):
+def delete_old_notifications(days, batch_size=None, sleep=None, raw=False):
     """
     Delete notifications having 'timestamp' more than "days" days.
+
+    Notifications are deleted from the oldest in batches of
+    "batch_size" notifications, each batch is committed in its
+    own transaction and "sleep" seconds are waited between batches.
+    The progress is stored in the cache, a run interrupted (e.g. by a
+    worker restart) is resumed by the next run with the same "days".
+
+    When "raw" is True, notifications are deleted with a raw DELETE
+    query which does not send the post_delete signal.
     """
-    Notification.objects.filter(
-        timestamp__lte=timezone.now() - timedelta(days=days)
-    ).delete()
+    batch_size = batch_size or app_settings.DELETE_OLD_NOTIFICATIONS_BATCH_SIZE
+    if sleep is None:
+        sleep = app_settings.DELETE_OLD_NOTIFICATIONS_SLEEP
+    progress = cache.get(DELETE_OLD_NOTIFICATIONS_PROGRESS_KEY)
+    if progress and progress["days"] == days:
+        logger.info(
+            f"Resuming deletion of notifications older than {days} days, "
+            f"{progress['deleted']} notifications were already deleted"
+        )
+    else:
+        progress = {
+            "days": days,
+            "cutoff": timezone.now() - timedelta(days=days),
+            "deleted": 0,
+            "batches": 0,
+        }
+    queryset = Notification.objects.filter(timestamp__lte=progress["cutoff"])
+    while True:
+        with transaction.atomic():
+            pks = list(
+                queryset.order_by("timestamp", "pk").values_list("pk", flat=True)[
+                    :batch_size
+                ]
+            )
+            if not pks:
+                break
+            deleted = _delete_notifications_batch(pks, raw=raw)
+        progress["deleted"] += deleted
+        progress["batches"] += 1
+        cache.set(DELETE_OLD_NOTIFICATIONS_PROGRESS_KEY, progress, timeout=None)
+        logger.info(
+            f"Deleted {deleted} notifications older than {days} days "
+            f"(batch {progress['batches']}, {progress['deleted']} in total)"
+        )
+        if sleep:
+            time.sleep(sleep)
+    cache.delete(DELETE_OLD_NOTIFICATIONS_PROGRESS_KEY)
+    return progress["deleted"]
+
+
+def _reconcile_unread_counters(user_ids):
+    keys = {user_id: Notification.count_cache_key(user_id) for user_id in user_ids}
+    cached = cache.get_many(keys.values())
+    cached_user_ids = [user_id for user_id, key in keys.items() if key in cached]
+    if not cached_user_ids:
+        return 0
+    counts = dict(
+        Notification.objects.filter(recipient_id__in=cached_user_ids, unread=True)
+        .values("recipient_id")
+        .annotate(unread_count=Count("id"))
+        .values_list("recipient_id", "unread_count")
+    )
+    fixed = {
+        keys[user_id]: counts.get(user_id, 0)
+        for user_id in cached_user_ids
+        if cached[keys[user_id]] != counts.get(user_id, 0)
+    }
+    cache.set_many(fixed, timeout=app_settings.CACHE_TIMEOUT)
+    return len(fixed)
+
+
+@shared_task
+def reconcile_unread_counters(chunk_size=1000):
+    """
+    Corrects the cached unread counters of users which have
+    drifted from the number of unread notifications stored
+    in the database (e.g. because of rolled back transactions).
+    """
+    fixed = 0
+    user_ids = []
+    for user_id in User.objects.values_list("pk", flat=True).iterator(
+        chunk_size=chunk_size
+    ):
+        user_ids.append(user_id)
+        if len(user_ids) >= chunk_size:
+            fixed += _reconcile_unread_counters(user_ids)
+            user_ids = []
+    if user_ids:
+        fixed += _reconcile_unread_counters(user_ids)
+    if fixed:
+        logger.info(f"Reconciled {fixed} unread notification counters")
+    return fixed
 
 
 def _resolve_initial_notification_setting(global_value, org_value):
@@ -97,51 +290,188 @@ def _resolve_initial_notification_setting(global_value, org_value):
     return None
 
 
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _ensure_global_notification_settings(user_ids, dry_run=False):
+    """
+    Creates (or revives) the global notification setting of the users
+    and returns a tuple containing a dictionary mapping user IDs to their
+    global setting and the number of created or revived settings.
+
+    When ``dry_run`` is ``True`` the database is not modified and
+    unsaved settings are returned for the users which do not have one.
+    """
+    global_settings = {
+        setting.user_id: setting
+        for setting in NotificationSetting.objects.filter(
+            user_id__in=user_ids, organization=None, type=None
+        ).only("pk", "user_id", "email", "web", "deleted")
+    }
+    revived = [setting.pk for setting in global_settings.values() if setting.deleted]
+    if revived and not dry_run:
+        NotificationSetting.objects.filter(pk__in=revived).update(deleted=False)
+    missing = [user_id for user_id in user_ids if user_id not in global_settings]
+    if not missing:
+        return global_settings, len(revived)
+    missing_settings = [
+        NotificationSetting(
+            user_id=user_id,
+            organization=None,
+            type=None,
+            email=True,
+            web=True,
+            _global=True,
+        )
+        for user_id in missing
+    ]
+    if dry_run:
+        global_settings.update(
+            {setting.user_id: setting for setting in missing_settings}
+        )
+        return global_settings, len(revived) + len(missing)
+    NotificationSetting.objects.bulk_create(missing_settings, ignore_conflicts=True)
+    # Re-read the rows, some of them may have been created concurrently
+    global_settings.update(
+        {
+            setting.user_id: setting
+            for setting in NotificationSetting.objects.filter(
+                user_id__in=missing, organization=None, type=None
+            ).only("pk", "user_id", "email", "web", "deleted")
+        }
+    )
+    return global_settings, len(revived) + len(missing)
+
+
 # Following tasks updates notification settings in database.
 # 'ns' is short for notification_setting
-def create_notification_settings(user, organizations, notification_types):
-    global_setting, _ = NotificationSetting.objects.get_or_create(
-        user=user, organization=None, type=None, defaults={"email": True, "web": True}
-    )
-    if global_setting.deleted:
-        global_setting.deleted = False
-        global_setting.save(update_fields=["deleted"])
-
-    for type in notification_types:
-        for org in organizations:
-            # Any new notification setting shall inherit user's global
-            # notification preferences.
-            try:
-                org_notification_settings = org.notification_settings
-                org_email = org_notification_settings.email
-                org_web = org_notification_settings.web
-            except ObjectDoesNotExist:
-                org_email = app_settings.EMAIL_ENABLED
-                org_web = app_settings.WEB_ENABLED
-
-            email = _resolve_initial_notification_setting(
-                global_setting.email,
-                org_email,
+def bulk_create_notification_settings(
+    users,
+    organizations,
+    notification_types,
+    batch_size=1000,
+    dry_run=False,
+    progress=None,
+):
+    """
+    Ensures that each of ``users`` has a notification setting for
+    every combination of ``organizations`` and ``notification_types``
+    and a global notification setting.
+
+    Existing settings are diffed against the desired grid in memory:
+    soft-deleted settings are revived with one UPDATE query per chunk
+    and missing settings are inserted with ``bulk_create``. Users are
+    processed in chunks of about ``batch_size`` settings.
+
+    Returns the number of created or revived settings. When ``dry_run``
+    is ``True`` the database is left untouched and only the number of
+    settings which would have been changed is returned. ``progress``,
+    if passed, is called after each chunk with the number of processed
+    users and of changed settings.
+    """
+    if isinstance(organizations, QuerySet):
+        organizations = organizations.select_related("notification_settings")
+    organizations = list(organizations)
+    notification_types = list(notification_types)
+    org_preferences = {}
+    for org in organizations:
+        # Any new notification setting shall inherit user's global
+        # notification preferences.
+        try:
+            org_notification_settings = org.notification_settings
+            org_preferences[org.pk] = (
+                org_notification_settings.email,
+                org_notification_settings.web,
+            )
+        except ObjectDoesNotExist:
+            org_preferences[org.pk] = (
+                app_settings.EMAIL_ENABLED,
+                app_settings.WEB_ENABLED,
             )
-            web = _resolve_initial_notification_setting(
-                global_setting.web,
-                org_web,
+    cells_per_user = max(len(organizations) * len(notification_types), 1)
+    users_per_chunk = max(batch_size // cells_per_user, 1)
+    user_ids = (getattr(user, "pk", user) for user in users)
+    total = 0
+    for chunk in _chunks(user_ids, users_per_chunk):
+        global_settings, changed = _ensure_global_notification_settings(
+            chunk, dry_run=dry_run
+        )
+        if organizations and notification_types:
+            changed += _sync_notification_settings_chunk(
+                chunk,
+                global_settings,
+                organizations,
+                org_preferences,
+                notification_types,
+                batch_size,
+                dry_run,
             )
-            # If NotificationSetting already exists, then we ensure it is not marked deleted
-            updated = NotificationSetting.objects.filter(
-                user=user, type=type, organization=org
-            ).update(deleted=False)
-            if not updated:
-                # "updated" will be 0 if no NotificationSetting was found.
-                # In this case, we create a new NotificationSetting.
-                NotificationSetting.objects.create(
-                    user=user,
+        total += changed
+        if progress:
+            progress(len(chunk), changed)
+    return total
+
+
+def _sync_notification_settings_chunk(
+    user_ids,
+    global_settings,
+    organizations,
+    org_preferences,
+    notification_types,
+    batch_size,
+    dry_run,
+):
+    existing = {}
+    for pk, user_id, org_id, type, deleted in NotificationSetting.objects.filter(
+        user_id__in=user_ids,
+        organization_id__in=[org.pk for org in organizations],
+        type__in=notification_types,
+    ).values_list("pk", "user_id", "organization_id", "type", "deleted"):
+        existing[(user_id, org_id, type)] = (pk, deleted)
+    revived = [pk for pk, deleted in existing.values() if deleted]
+    if not dry_run:
+        for pks in _chunks(revived, batch_size):
+            NotificationSetting.objects.filter(pk__in=pks).update(deleted=False)
+    missing = []
+    for user_id in user_ids:
+        global_setting = global_settings[user_id]
+        for type in notification_types:
+            for org in organizations:
+                if (user_id, org.pk, type) in existing:
+                    continue
+                org_email, org_web = org_preferences[org.pk]
+                setting = NotificationSetting(
+                    user_id=user_id,
                     type=type,
                     organization=org,
-                    email=email,
-                    web=web,
+                    email=_resolve_initial_notification_setting(
+                        global_setting.email, org_email
+                    ),
+                    web=_resolve_initial_notification_setting(
+                        global_setting.web, org_web
+                    ),
                     deleted=False,
                 )
+                # bulk_create() does not call save()
+                setting.normalize_settings()
+                missing.append(setting)
+    if missing and not dry_run:
+        NotificationSetting.objects.bulk_create(
+            missing, batch_size=batch_size, ignore_conflicts=True
+        )
+    return len(revived) + len(missing)
+
+
+def create_notification_settings(user, organizations, notification_types):
+    bulk_create_notification_settings([user], organizations, notification_types)
 
 
 @shared_task(base=OpenwispCeleryTask)
@@ -179,46 +509,256 @@ def superuser_demoted_notification_setting(user_id):
     qs.update(deleted=True)
 
 
-@shared_task(base=OpenwispCeleryTask)
-def ns_register_unregister_notification_type(
-    notification_type=None, delete_unregistered=True
-):
+def _populate_organizations(organizations, notification_types, **options):
     """
-    Creates notification setting for registered notification types.
-    Deletes notification for unregistered notification types.
+    Creates notification settings of ``notification_types`` in
+    ``organizations`` for superusers and organization administrators.
     """
+    organizations = list(organizations)
+    # Create notification settings for superusers
+    changed = bulk_create_notification_settings(
+        User.objects.filter(is_superuser=True).values_list("pk", flat=True),
+        organizations,
+        notification_types,
+        **options,
+    )
+    # Create notification settings for organization admin
+    org_admins = {}
+    for org_id, user_id in OrganizationUser.objects.filter(
+        is_admin=True,
+        user__is_superuser=False,
+        organization_id__in=[org.pk for org in organizations],
+    ).values_list("organization_id", "user_id"):
+        org_admins.setdefault(org_id, []).append(user_id)
+    for organization in organizations:
+        if organization.pk not in org_admins:
+            continue
+        changed += bulk_create_notification_settings(
+            org_admins[organization.pk], [organization], notification_types, **options
+        )
+    return changed
+
 
-    notification_types = (
-        [notification_type] if notification_type else types.NOTIFICATION_TYPES.keys()
+def _populate_global_settings(**options):
+    """
+    Creates the global notification settings of superusers and staff users.
+    """
+    return bulk_create_notification_settings(
+        User.objects.filter(Q(is_superuser=True) | Q(is_staff=True)).values_list(
+            "pk", flat=True
+        ),
+        [],
+        [],
+        **options,
     )
 
-    organizations = Organization.objects.all()
-    # Create notification settings for superusers
-    for user in User.objects.filter(is_superuser=True).iterator():
-        create_notification_settings(user, organizations, notification_types)
 
-    # Create notification settings for staff users
-    # Skip during single-type registration since global rows are independent of types
-    if notification_type is None:
-        for user in User.objects.filter(is_staff=True, is_superuser=False).iterator():
-            create_notification_settings(user, [], [])
+def _delete_unregistered_notification_types():
+    registered_types = list(types.NOTIFICATION_TYPES.keys())
+    # Delete all notification settings for unregistered notification types
+    # exclude(type=None) protects the global settings row from deletion
+    NotificationSetting.objects.exclude(type__in=registered_types).exclude(
+        type=None
+    ).update(deleted=True)
+    # Delete notifications related to unregister notification types
+    Notification.objects.exclude(type__in=registered_types).delete()
 
-    # Create notification settings for organization admin
-    for org_user in OrganizationUser.objects.select_related(
-        "user", "organization"
-    ).filter(is_admin=True, user__is_superuser=False):
-        create_notification_settings(
-            org_user.user, [org_user.organization], notification_types
+
+def _set_populated_notification_types(notification_types):
+    """
+    Persists the fingerprint of the registered notification types if
+    ``notification_types``, together with the types populated by the
+    previous runs, cover all of them.
+    """
+    registered_types = set(types.NOTIFICATION_TYPES)
+    populated_types = types.get_populated_notification_types() or []
+    if set(notification_types) | set(populated_types) >= registered_types:
+        types.set_populated_notification_types(registered_types)
+
+
+def notification_settings_populated(notification_types):
+    """
+    Returns ``False`` if the notification settings of ``notification_types``
+    are missing from the database, e.g. when the database has been
+    recreated or restored while the cache has been preserved.
+
+    Superusers, or otherwise organization administrators, get the
+    notification settings of all the types, hence one of them is checked.
+    """
+    user_id = User.objects.filter(is_superuser=True).values_list("pk", flat=True)
+    org_id = Organization.objects.values_list("pk", flat=True)
+    user_id, org_id = user_id.first(), org_id.first()
+    if not (user_id and org_id):
+        user_id, org_id = (
+            OrganizationUser.objects.filter(is_admin=True)
+            .values_list("user_id", "organization_id")
+            .first()
+        ) or (None, None)
+    if not user_id:
+        # There are no notification settings to populate
+        return True
+    populated_count = (
+        NotificationSetting.objects.filter(
+            user_id=user_id, organization_id=org_id, type__in=notification_types
         )
+        .values("type")
+        .distinct()
+        .count()
+    )
+    return populated_count == len(set(notification_types))
+
+
+def populate_notification_settings(
+    notification_types=None,
+    organizations=None,
+    delete_unregistered=True,
+    dry_run=False,
+    progress=None,
+):
+    """
+    Creates notification settings for ``notification_types`` (defaults
+    to all the registered notification types) in ``organizations``
+    (defaults to all the organizations) and, if ``delete_unregistered``
+    is ``True``, deletes the notification settings and notifications
+    of the notification types which are not registered anymore.
+
+    Once all the registered notification types have been populated for
+    all the organizations, the fingerprint of the registered types is
+    persisted, which allows the following runs to process only the
+    notification types which have been registered in the meantime.
+
+    Returns the number of created or revived notification settings.
+    """
+    if notification_types is None:
+        notification_types = types.NOTIFICATION_TYPES.keys()
+    notification_types = list(notification_types)
+    all_organizations = organizations is None
+    if all_organizations:
+        organizations = Organization.objects.all()
+    if isinstance(organizations, QuerySet):
+        organizations = organizations.select_related("notification_settings")
+    options = dict(dry_run=dry_run, progress=progress)
+    changed = _populate_organizations(organizations, notification_types, **options)
+    # Global rows are independent of types, hence they are only
+    # ensured when all the registered types are populated
+    if all_organizations and set(notification_types) == set(types.NOTIFICATION_TYPES):
+        changed += _populate_global_settings(**options)
+    if delete_unregistered and not dry_run:
+        _delete_unregistered_notification_types()
+        if all_organizations:
+            _set_populated_notification_types(notification_types)
+    return changed
+
+
+POPULATE_RUN_CACHE_KEY = "ow-notifications-populate-run-{}"
+POPULATE_RUN_TIMEOUT = 7 * 24 * 60 * 60
+
+
+def _populate_run_step_done(run_id, notification_types):
+    """
+    Marks one of the tasks of a population run as completed.
+    The last completed task persists the fingerprint of the
+    registered notification types.
+    """
+    if not run_id:
+        return
+    key = POPULATE_RUN_CACHE_KEY.format(run_id)
+    try:
+        remaining = cache.decr(key)
+    except ValueError:
+        # The run has expired
+        return
+    if remaining <= 0:
+        cache.delete(key)
+        _set_populated_notification_types(notification_types)
+
+
+@shared_task(base=OpenwispCeleryTask)
+def ns_populate_notification_settings_shard(
+    notification_types, organization_ids=None, run_id=None
+):
+    """
+    Creates notification settings of ``notification_types`` for the
+    organizations in ``organization_ids``, or the global notification
+    settings of privileged users if ``organization_ids`` is ``None``.
 
+    The task is idempotent, hence a failed shard can be retried alone.
+    """
+    if organization_ids is None:
+        _populate_global_settings()
+    else:
+        _populate_organizations(
+            Organization.objects.filter(pk__in=organization_ids).select_related(
+                "notification_settings"
+            ),
+            notification_types,
+        )
+    _populate_run_step_done(run_id, notification_types)
+
+
+@shared_task(base=OpenwispCeleryTask)
+def ns_delete_unregistered_notification_types(notification_types, run_id=None):
+    """
+    Deletes notification settings and notifications
+    of unregistered notification types.
+    """
+    _delete_unregistered_notification_types()
+    _populate_run_step_done(run_id, notification_types)
+
+
+@shared_task(base=OpenwispCeleryTask)
+def ns_register_unregister_notification_type(
+    notification_type=None, delete_unregistered=True, notification_types=None
+):
+    """
+    Creates notification setting for registered notification types.
+    Deletes notification for unregistered notification types.
+
+    The work is split in shards of organizations which are executed
+    in parallel by the celery workers.
+    """
+    if notification_type:
+        notification_types = [notification_type]
+    if notification_types is None:
+        notification_types = list(types.NOTIFICATION_TYPES.keys())
+    # The fingerprint of the registered types is persisted
+    # by the last completed task of the run
+    run_id = str(uuid4()) if delete_unregistered else None
+    org_ids = Organization.objects.order_by("pk").values_list("pk", flat=True)
+    if not notification_types:
+        # Only the cleanup of unregistered types is needed
+        org_ids = []
+    shards = [
+        ns_populate_notification_settings_shard.si(
+            notification_types,
+            organization_ids=[str(pk) for pk in chunk],
+            run_id=run_id,
+        )
+        for chunk in _chunks(org_ids, app_settings.POPULATE_PREFERENCES_SHARD_SIZE)
+    ]
+    # Global rows are independent of types, hence they are only
+    # ensured when all the registered types are populated
+    if set(notification_types) == set(types.NOTIFICATION_TYPES):
+        shards.append(
+            ns_populate_notification_settings_shard.si(
+                notification_types, run_id=run_id
+            )
+        )
     if delete_unregistered:
-        # Delete all notification settings for unregistered notification types
-        # exclude(type=None) protects the global settings row from deletion
-        NotificationSetting.objects.exclude(type__in=notification_types).exclude(
-            type=None
-        ).update(deleted=True)
-        # Delete notifications related to unregister notification types
-        Notification.objects.exclude(type__in=notification_types).delete()
+        # The cleanup of unregistered types touches different rows
+        # than the shards, hence it does not need to wait for them
+        shards.append(
+            ns_delete_unregistered_notification_types.si(
+                notification_types, run_id=run_id
+            )
+        )
+        cache.set(
+            POPULATE_RUN_CACHE_KEY.format(run_id),
+            len(shards),
+            timeout=POPULATE_RUN_TIMEOUT,
+        )
+    if shards:
+        group(shards).apply_async()
 
 
 @shared_task(base=OpenwispCeleryTask)
@@ -262,19 +802,42 @@ def ns_organization_user_deleted(user_id, org_id):
     )
 
 
+ORGANIZATION_CREATED_LOCK_KEY = "ow-notifications-organization-created"
+
+
 @shared_task(base=OpenwispCeleryTask)
-def ns_organization_created(instance_id):
+def ns_organization_created(instance_id=None, organization_ids=None):
     """
     Adds notification setting of all registered types
-    for a newly created organization.
+    for newly created organizations.
+
+    If neither ``instance_id`` nor ``organization_ids`` are passed,
+    the notification settings are created for all the organizations
+    which lack the notification settings of superusers, this allows
+    coalescing bursts of organization creations in one task run.
     """
-    organization = Organization.objects.get(id=instance_id)
-    for user in User.objects.filter(is_superuser=True):
-        create_notification_settings(
-            user=user,
-            organizations=[organization],
-            notification_types=types.NOTIFICATION_TYPES.keys(),
+    superuser_ids = list(
+        User.objects.filter(is_superuser=True).values_list("pk", flat=True)
+    )
+    if instance_id:
+        organization_ids = [instance_id]
+    if organization_ids is not None:
+        organizations = Organization.objects.filter(pk__in=organization_ids)
+    else:
+        # Organizations created from now on will schedule a new run
+        cache.delete(ORGANIZATION_CREATED_LOCK_KEY)
+        organizations = Organization.objects.exclude(
+            pk__in=NotificationSetting.objects.filter(
+                user_id__in=superuser_ids, organization__isnull=False
+            ).values("organization_id")
         )
+    if not superuser_ids:
+        return
+    bulk_create_notification_settings(
+        superuser_ids,
+        organizations=organizations,
+        notification_types=types.NOTIFICATION_TYPES.keys(),
+    )
 
 
 @shared_task(base=OpenwispCeleryTask)
@@ -21,10 +21,10 @@ def get_notifications_count(context):
     cache_key = Notification.count_cache_key(user_pk)
     count = cache.get(cache_key)
     if count is None:
-        count = _get_user_unread_count(context["user"])
-        count = normalize_unread_count(count)
-        cache.set(cache_key, count)
-    return count
+        count = Notification.init_unread_count(
+            user_pk, _get_user_unread_count(context["user"])
+        )
+    return normalize_unread_count(count)
 
 
 def unread_notifications(context):
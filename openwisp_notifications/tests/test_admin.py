@@ -119,7 +119,7 @@ class TestAdmin(BaseTestAdmin):
     def test_cached_invalidation(self):
         cache_key = self.test_cached_value()
         notify.send(**self.notification_options)
-        self.assertIsNone(cache.get(cache_key))
+        self.assertEqual(cache.get(cache_key), 1)
         self.client.get(self._url)
         self.assertEqual(cache.get(cache_key), 1)
 
@@ -5,7 +5,9 @@ from unittest.mock import patch
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
+from django.db import connection
 from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework.exceptions import ErrorDetail
@@ -152,6 +154,69 @@ class TestNotificationApi(
                 n["email_subject"], "[example.com] Default Notification Subject"
             )
 
+    def test_list_notification_cursor_pagination(self):
+        number_of_notifications = 21
+        for _ in range(number_of_notifications):
+            notify.send(sender=self.admin, type="default", target=self.admin)
+        url = self._get_path("notifications_list", pagination="cursor")
+        expected = [
+            str(pk)
+            for pk in Notification.objects.filter(recipient=self.admin)
+            .order_by("-timestamp", "-id")
+            .values_list("pk", flat=True)
+        ]
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("count", response.data)
+        self.assertEqual(response.data["previous"], None)
+        self.assertIn("pagination=cursor", response.data["next"])
+        self.assertEqual(len(response.data["results"]), 20)
+
+        next_response = self.client.get(response.data["next"])
+        self.assertEqual(next_response.status_code, 200)
+        self.assertEqual(next_response.data["next"], None)
+        self.assertEqual(len(next_response.data["results"]), 1)
+        self.assertEqual(
+            [
+                str(n["id"])
+                for n in response.data["results"] + next_response.data["results"]
+            ],
+            expected,
+        )
+
+        with self.subTest("Filtering and page size"):
+            response = self.client.get(f"{url}&unread=true&page_size=5")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data["results"]), 5)
+
+    def test_list_notification_related_objects_primed(self):
+        for index in range(10):
+            target = self._create_user(
+                username=f"primed{index}", email=f"primed{index}@test.com"
+            )
+            notify.send(sender=self.admin, type="default", target=target)
+
+        def get_query_count(page_size):
+            cache.clear()
+            url = self._get_path("notifications_list", page_size=page_size)
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data["results"]), page_size)
+            return len(context.captured_queries)
+
+        # Warms up the caches which are not related to notifications
+        get_query_count(1)
+        self.assertEqual(get_query_count(2), get_query_count(10))
+
+        with self.subTest("Primed objects are cached"):
+            Notification.prime_related_objects([Notification.objects.first()])
+            notification = Notification.objects.first()
+            with self.assertNumQueries(0):
+                Notification.prime_related_objects([notification])
+                self.assertEqual(notification.target.username, "primed9")
+
     def test_list_notification_filtering(self):
         url = self._get_path("notifications_list")
         notify.send(sender=self.admin, type="default", target=self.admin)
@@ -195,6 +260,7 @@ class TestNotificationApi(
         # Verify notifications are marked read in database
         for n in Notification.objects.all():
             self.assertFalse(n.unread)
+        self.assertEqual(cache.get(Notification.count_cache_key(self.admin.pk)), 0)
 
     def test_retreive_notification_api(self):
         notify.send(sender=self.admin, type="default", target=self.admin)
@@ -6,13 +6,17 @@ from unittest.mock import patch
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.messages.storage.fallback import FallbackStorage
+from django.core.cache import cache
 from django.http import HttpRequest
 from django.utils import timezone
 
 from openwisp_notifications.base.models import NOTIFICATION_CHOICES
 from openwisp_notifications.swapper import load_model
 from openwisp_notifications.tasks import ns_register_unregister_notification_type
-from openwisp_notifications.types import NOTIFICATION_TYPES
+from openwisp_notifications.types import (
+    NOTIFICATION_TYPES,
+    POPULATED_NOTIFICATION_TYPES_CACHE_KEY,
+)
 from openwisp_notifications.types import (
     register_notification_type as base_register_notification_type,
 )
@@ -87,16 +91,23 @@ def mock_notification_types(func):
     This decorator mocks the NOTIFICATION_CHOICES and NOTIFICATION_TYPES
     to prevent polluting the test environment with any notification types
     registered during the test.
+
+    The persisted fingerprint of the populated notification types is
+    discarded as well, because it does not match the mocked registry.
     """
 
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        with patch.multiple(
-            "openwisp_notifications.types",
-            NOTIFICATION_CHOICES=deepcopy(NOTIFICATION_CHOICES),
-            NOTIFICATION_TYPES=deepcopy(NOTIFICATION_TYPES),
-        ):
-            return func(*args, **kwargs)
+        cache.delete(POPULATED_NOTIFICATION_TYPES_CACHE_KEY)
+        try:
+            with patch.multiple(
+                "openwisp_notifications.types",
+                NOTIFICATION_CHOICES=deepcopy(NOTIFICATION_CHOICES),
+                NOTIFICATION_TYPES=deepcopy(NOTIFICATION_TYPES),
+            ):
+                return func(*args, **kwargs)
+        finally:
+            cache.delete(POPULATED_NOTIFICATION_TYPES_CACHE_KEY)
 
     return wrapper
 
@@ -1,7 +1,8 @@
+import gc
 import json
 from datetime import datetime, timedelta
 from datetime import timezone as dt_timezone
-from unittest.mock import patch
+from unittest.mock import AsyncMock, patch
 from uuid import uuid4
 
 from allauth.account.models import EmailAddress
@@ -13,9 +14,11 @@ from django.contrib.messages import get_messages
 from django.core import mail
 from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
 from django.db.models.signals import post_migrate, post_save
 from django.template import TemplateDoesNotExist
 from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.functional import Promise
@@ -24,9 +27,12 @@ from django.utils.translation import gettext_lazy
 from freezegun import freeze_time
 
 from openwisp_notifications import settings as app_settings
-from openwisp_notifications import tasks, utils
+from openwisp_notifications import tasks, types, utils
+from openwisp_notifications.api.serializers import NotificationListSerializer
+from openwisp_notifications.base import models as base_models
 from openwisp_notifications.exceptions import NotificationRenderException
 from openwisp_notifications.handlers import (
+    notification_type_registered_unregistered_handler,
     notify_handler,
     register_notification_cache_update,
 )
@@ -45,6 +51,7 @@ from openwisp_notifications.types import (
     get_notification_configuration,
 )
 from openwisp_notifications.utils import _get_absolute_url, get_unsubscribe_url_for_user
+from openwisp_notifications.websockets import handlers as ws_handlers
 from openwisp_users.tests.utils import TestOrganizationMixin
 from openwisp_utils.tests import capture_any_output
 
@@ -54,11 +61,13 @@ from . import (
 )
 
 User = get_user_model()
+Organization = swapper_load_model("openwisp_users", "Organization")
 OrganizationUser = swapper_load_model("openwisp_users", "OrganizationUser")
 Group = swapper_load_model("openwisp_users", "Group")
 Notification = load_model("Notification")
 NotificationSetting = load_model("NotificationSetting")
 OrganizationNotificationSettings = load_model("OrganizationNotificationSettings")
+IgnoreObjectNotification = load_model("IgnoreObjectNotification")
 NotificationAppConfig = apps.get_app_config(Notification._meta.app_label)
 # reused across tests
 start_time = timezone.now()
@@ -334,6 +343,314 @@ class TestNotifications(TestOrganizationMixin, TransactionTestCase):
             '<div class="email-title">1 unread notification</div>', html_email
         )
 
+    @patch("openwisp_notifications.websockets.handlers.notifications_update_handler")
+    @patch("openwisp_notifications.websockets.handlers.notification_update_handler")
+    def test_bulk_create_notifications(self, mocked_ws_handler, mocked_batch_handler):
+        admin2 = self._create_admin(username="admin2", email="admin2@example.com")
+        fields = [
+            "recipient_id",
+            "actor_object_id",
+            "verb",
+            "level",
+            "type",
+            "description",
+            "data",
+            "unread",
+            "emailed",
+        ]
+        queryset = notification_queryset.order_by("recipient__username")
+        self._create_notification()
+        expected_rows = list(queryset.values_list(*fields))
+        expected_emails = [email.to for email in mail.outbox]
+        self.assertEqual(len(expected_rows), 2)
+        Notification.objects.all().delete()
+        mail.outbox.clear()
+        for user in [self.admin, admin2]:
+            cache.delete(Notification.get_user_batched_notifications_cache_key(user))
+        mocked_ws_handler.reset_mock()
+
+        with patch.object(app_settings, "BULK_CREATE", True), patch.object(
+            app_settings, "BULK_CREATE_BATCH_SIZE", 1
+        ):
+            notifications = self._create_notification().pop()[1]
+        self.assertEqual(len(notifications), 2)
+        self.assertEqual(list(queryset.values_list(*fields)), expected_rows)
+        self.assertEqual([email.to for email in mail.outbox], expected_emails)
+        mocked_ws_handler.assert_not_called()
+        self.assertEqual(mocked_batch_handler.call_count, 2)
+
+    def test_batched_websocket_updates_payloads(self):
+        self._create_admin(username="admin2", email="admin2@example.com")
+        with patch.object(app_settings, "BULK_CREATE", True), patch.object(
+            ws_handlers, "_group_send_many", new_callable=AsyncMock
+        ) as mocked_group_send, patch.object(
+            NotificationListSerializer,
+            "to_representation",
+            autospec=True,
+            side_effect=NotificationListSerializer.to_representation,
+        ) as mocked_serializer:
+            notifications = self._create_notification().pop()[1]
+        # The contents are rendered once for all the recipients
+        mocked_serializer.assert_called_once()
+        messages = dict(mocked_group_send.call_args.args[1])
+        self.assertEqual(len(messages), 2)
+        for notification in notifications:
+            message = messages[f"ow-notification-{notification.recipient_id}"]
+            self.assertEqual(
+                message["notification"],
+                NotificationListSerializer(notification).data,
+            )
+
+    def test_email_preferences_resolved_in_bulk(self):
+        admin2 = self._create_admin(username="admin2", email="admin2@example.com")
+        org_user = self._get_org_user()
+        org = org_user.organization
+
+        with self.subTest("Helper returns recipients with email enabled"):
+            self.assertEqual(
+                utils.get_email_notification_recipients(
+                    [self.admin, admin2], "default", org.pk
+                ),
+                {self.admin.pk, admin2.pk},
+            )
+            NotificationSetting.objects.filter(
+                user=admin2, organization=org, type="default"
+            ).update(email=False)
+            with self.assertNumQueries(2):
+                recipients = utils.get_email_notification_recipients(
+                    [self.admin, admin2], "default", org.pk
+                )
+            self.assertEqual(recipients, {self.admin.pk})
+            admin2.emailaddress_set.update(verified=False)
+            self.assertEqual(
+                utils.get_email_notification_recipients(
+                    [self.admin, admin2], "generic_message"
+                ),
+                set(),
+            )
+            self.assertEqual(
+                utils.get_email_notification_recipients([admin2], "default"),
+                set(),
+            )
+
+        with self.subTest("Email stage does not query preferences per recipient"):
+            self.notification_options.update({"target": org_user})
+            with patch(
+                "openwisp_notifications.handlers.get_user_email_preference"
+            ) as mocked_preference:
+                self._create_notification()
+            mocked_preference.assert_not_called()
+            self.assertEqual(notification_queryset.count(), 2)
+            self.assertEqual(len(mail.outbox), 1)
+            self.assertEqual(mail.outbox[0].to, [self.admin.email])
+
+    @patch.object(app_settings, "ASYNC_NOTIFY", True)
+    def test_async_notify(self):
+        operator = self._get_operator()
+        self.notification_options.update(
+            {"target": operator, "action_object": operator}
+        )
+        with self.subTest("Arguments are serialized for the celery task"):
+            with patch.object(tasks.notify_async, "delay") as mocked_task:
+                result = self._create_notification()
+            self.assertIsNone(result[0][1])
+            self.assertEqual(notification_queryset.count(), 0)
+            mocked_task.assert_called_once()
+            call_kwargs = mocked_task.call_args.kwargs
+            operator_content_type = ContentType.objects.get_for_model(operator)
+            self.assertEqual(
+                call_kwargs["actor"],
+                [ContentType.objects.get_for_model(self.admin).pk, str(self.admin.pk)],
+            )
+            self.assertEqual(
+                call_kwargs["target"], [operator_content_type.pk, str(operator.pk)]
+            )
+            self.assertIsNone(call_kwargs["recipient"])
+            self.assertEqual(call_kwargs["type"], "default")
+
+        with self.subTest("Notifications are created by the celery task"):
+            self._create_notification()
+            self.assertEqual(notification_queryset.count(), 1)
+            n = notification_queryset.first()
+            self.assertEqual(n.recipient, self.admin)
+            self.assertEqual(n.actor, self.admin)
+            self.assertEqual(n.target, operator)
+            self.assertEqual(n.action_object, operator)
+            self.assertEqual(n.description, "Test Notification")
+            self.assertEqual(n.data["url"], "https://localhost:8000/admin")
+
+        with self.subTest("Deleted recipients are not replaced by default ones"):
+            notification_queryset.delete()
+            recipient = self._create_user(
+                username="recipient", email="recipient@example.com"
+            )
+            with patch.object(tasks.notify_async, "delay") as mocked_task:
+                notify.send(sender=self.admin, type="default", recipient=recipient)
+            call_kwargs = mocked_task.call_args.kwargs
+            self.assertEqual(call_kwargs["recipient"], {"users": [str(recipient.pk)]})
+            recipient.delete()
+            tasks.notify_async(**call_kwargs)
+            self.assertEqual(notification_queryset.count(), 0)
+
+        with self.subTest("Validation errors are raised synchronously"):
+            with self.assertRaisesRegex(ValueError, "target_url_suffix"):
+                self._create_notification(target_url_suffix="invalid")
+
+    def test_unread_counter(self):
+        cache_key = Notification.count_cache_key(self.admin.pk)
+
+        with self.subTest("Counter initialized from the database"):
+            with self.assertNumQueries(1):
+                self.assertEqual(Notification.get_unread_count(self.admin), 0)
+            with self.assertNumQueries(0):
+                self.assertEqual(Notification.get_unread_count(self.admin), 0)
+
+        with self.subTest("Counter incremented on creation"):
+            self._create_notification()
+            self._create_notification()
+            self.assertEqual(cache.get(cache_key), 2)
+
+        with self.subTest("Counter decremented on mark as read"):
+            notification_queryset.first().mark_as_read()
+            self.assertEqual(cache.get(cache_key), 1)
+
+        with self.subTest("Counter decremented on deletion of unread notifications"):
+            notification_queryset.filter(unread=False).delete()
+            self.assertEqual(cache.get(cache_key), 1)
+            notification_queryset.filter(unread=True).delete()
+            self.assertEqual(cache.get(cache_key), 0)
+
+        with self.subTest("Counter incremented on bulk creation"):
+            with patch.object(app_settings, "BULK_CREATE", True):
+                self._create_notification()
+            self.assertEqual(cache.get(cache_key), 1)
+
+        with self.subTest("Drifted counters are reconciled"):
+            cache.set(cache_key, 10)
+            tasks.reconcile_unread_counters.delay()
+            self.assertEqual(cache.get(cache_key), 1)
+
+    def test_notification_storm_counters(self):
+        storm_config = app_settings.NOTIFICATION_STORM_PREVENTION
+
+        def db_storm_check():
+            # Reference implementation of the checks based on database queries
+            datetime_now = timezone.now()
+            for period, count in (
+                ("short_term_time_period", "short_term_notification_count"),
+                ("long_term_time_period", "long_term_notification_count"),
+            ):
+                recent = self.admin.notifications.filter(
+                    timestamp__gte=datetime_now
+                    - timedelta(seconds=storm_config[period])
+                ).count()
+                if recent > storm_config[count]:
+                    return True
+            return False
+
+        def assert_storm_check(num_queries=0):
+            cache.delete(f"ow-noti-storm-{self.admin.pk}")
+            with self.assertNumQueries(num_queries):
+                in_storm = ws_handlers.user_in_notification_storm(self.admin)
+            self.assertEqual(in_storm, db_storm_check())
+            return in_storm
+
+        with self.subTest("Timestamps are loaded once from the database"):
+            self.assertFalse(assert_storm_check(num_queries=1))
+
+        with self.subTest("Storm detected without counting queries"):
+            results = []
+            for _ in range(storm_config["short_term_notification_count"] + 2):
+                self._create_notification()
+                results.append(assert_storm_check())
+            self.assertFalse(results[0])
+            self.assertTrue(results[-1])
+
+        with self.subTest("Timestamps are loaded again after deletion"):
+            notification_queryset.first().delete()
+            self.assertTrue(assert_storm_check(num_queries=1))
+            assert_storm_check()
+
+        with self.subTest("Counters are incremented atomically"):
+            notification = notification_queryset.first()
+            bucket = ws_handlers._storm_bucket(
+                notification.timestamp, ws_handlers._storm_window()[2]
+            )
+            key = ws_handlers._storm_count_key(self.admin.pk, bucket)
+            count = cache.get(key)
+            with patch.object(cache, "set", side_effect=AssertionError):
+                ws_handlers.record_notification_timestamps([notification] * 2)
+            self.assertEqual(cache.get(key), count + 2)
+
+        with self.subTest("At most the needed notifications are loaded"):
+            self.assertGreater(notification_queryset.count(), 2)
+            with patch.dict(
+                storm_config,
+                short_term_notification_count=1,
+                long_term_notification_count=1,
+            ):
+                counts = ws_handlers._load_notification_counts([self.admin.pk])
+            self.assertEqual(sum(counts[self.admin.pk].values()), 2)
+
+        with self.subTest("Counters of deleted notifications are discarded"):
+            notification_queryset.delete()
+            cache.delete(f"ow-noti-storm-{self.admin.pk}")
+            self.assertFalse(ws_handlers.user_in_notification_storm(self.admin))
+
+    @patch.dict(
+        app_settings.NOTIFICATION_STORM_PREVENTION,
+        short_term_time_period=10,
+        long_term_time_period=20,
+    )
+    def test_notification_storm_counters_bucket_boundaries(self):
+        storm_config = app_settings.NOTIFICATION_STORM_PREVENTION
+        # Notifications are counted in buckets of 5 seconds
+        self.assertEqual(ws_handlers._storm_window()[2], 5)
+        start = datetime(2020, 5, 4, tzinfo=dt_timezone.utc)
+        offsets = [0, 0.5, 4.999999, 5, 7.3, 9.999999, 10, 12]
+        with freeze_time(start + timedelta(seconds=10)):
+            ws_handlers.get_recent_notification_counts([self.admin.pk])
+        for offset in offsets:
+            Notification.objects.create(
+                recipient=self.admin,
+                actor=self.admin,
+                type="default",
+                timestamp=start + timedelta(seconds=offset),
+            )
+
+        def assert_exact_checks(reload):
+            for offset in [10, 10.5, 14.999999, 15, 15.000001, 17.3, 19.999999, 22]:
+                datetime_now = start + timedelta(seconds=offset)
+                with freeze_time(datetime_now):
+                    if reload:
+                        ws_handlers.discard_notification_timestamps([self.admin.pk])
+                    counts = ws_handlers.get_recent_notification_counts(
+                        [self.admin.pk]
+                    )[self.admin.pk]
+                    # Reference count of the checks based on database queries
+                    recent = self.admin.notifications.filter(
+                        timestamp__gte=datetime_now - timedelta(seconds=10)
+                    ).count()
+                    for threshold in range(len(offsets) + 1):
+                        with patch.dict(
+                            storm_config,
+                            short_term_notification_count=threshold,
+                            long_term_notification_count=len(offsets),
+                        ):
+                            self.assertEqual(
+                                ws_handlers._in_notification_storm(
+                                    self.admin.pk, counts
+                                ),
+                                recent > threshold,
+                                f"now={datetime_now}, threshold={threshold}",
+                            )
+
+        with self.subTest("Incremented counters"):
+            assert_exact_checks(reload=False)
+
+        with self.subTest("Counters loaded from the database"):
+            assert_exact_checks(reload=True)
+
     def test_email_disabled(self):
         self.notification_options.update(
             {"type": "default", "target": self._get_org_user()}
@@ -923,6 +1240,107 @@ class TestNotifications(TestOrganizationMixin, TransactionTestCase):
         tasks.delete_old_notifications.delay(days_old)
         self.assertEqual(notification_queryset.count(), 1)
 
+    def test_bulk_create_notification_settings(self):
+        for index in range(3):
+            self._create_org(name=f"bulk-org-{index}", slug=f"bulk-org-{index}")
+        user = self._create_user(username="bulk", email="bulk@example.com")
+        other_user = self._create_user(username="other", email="other@example.com")
+        notification_types = list(types.NOTIFICATION_TYPES.keys())
+        organizations = Organization.objects.all()
+        user_settings = NotificationSetting.objects.filter(
+            user=user, organization__isnull=False
+        )
+
+        with self.subTest("Missing settings are created"):
+            with CaptureQueriesContext(connection) as grid_context:
+                tasks.bulk_create_notification_settings(
+                    [user], organizations, notification_types
+                )
+            self.assertEqual(
+                user_settings.count(),
+                organizations.count() * len(notification_types),
+            )
+            self.assertTrue(
+                NotificationSetting.objects.filter(
+                    user=user, organization=None, type=None
+                ).exists()
+            )
+
+        with self.subTest("Number of queries does not depend on the grid size"):
+            single_organization = Organization.objects.filter(pk=self._get_org().pk)
+            with CaptureQueriesContext(connection) as single_context:
+                tasks.bulk_create_notification_settings(
+                    [other_user], single_organization, notification_types[:1]
+                )
+            self.assertEqual(len(grid_context), len(single_context))
+
+        with self.subTest("Deleted settings are revived"):
+            NotificationSetting.objects.filter(user=user).update(deleted=True)
+            with CaptureQueriesContext(connection) as context:
+                tasks.bulk_create_notification_settings(
+                    [user], organizations, notification_types
+                )
+            self.assertFalse(
+                NotificationSetting.objects.filter(user=user, deleted=True).exists()
+            )
+            updates = [
+                query
+                for query in context.captured_queries
+                if query["sql"].startswith("UPDATE")
+            ]
+            # One query for the global setting and one for the other settings
+            self.assertEqual(len(updates), 2)
+            self.assertEqual(
+                user_settings.count(),
+                organizations.count() * len(notification_types),
+            )
+
+    def test_delete_old_notifications_in_batches(self):
+        days_old = 91
+        cache_key = Notification.count_cache_key(self.admin.pk)
+        self._create_notification()
+        self.notification_options.update(
+            {"timestamp": timezone.now() - timedelta(days=days_old + 1)}
+        )
+        for _ in range(5):
+            self._create_notification()
+        self.assertEqual(Notification.get_unread_count(self.admin), 6)
+
+        with self.subTest("Notifications are deleted in batches"):
+            with patch.object(tasks.logger, "info") as mocked_logger:
+                deleted = tasks.delete_old_notifications.delay(
+                    days_old, batch_size=2
+                ).get()
+            self.assertEqual(deleted, 5)
+            self.assertEqual(mocked_logger.call_count, 3)
+            self.assertEqual(notification_queryset.count(), 1)
+            self.assertEqual(cache.get(cache_key), 1)
+            self.assertIsNone(cache.get(tasks.DELETE_OLD_NOTIFICATIONS_PROGRESS_KEY))
+
+        with self.subTest("Interrupted deletion is resumed"):
+            self._create_notification()
+            cutoff = timezone.now() - timedelta(days=days_old)
+            cache.set(
+                tasks.DELETE_OLD_NOTIFICATIONS_PROGRESS_KEY,
+                {"days": days_old, "cutoff": cutoff, "deleted": 4, "batches": 2},
+            )
+            with patch.object(tasks.logger, "info") as mocked_logger:
+                tasks.delete_old_notifications.delay(days_old, batch_size=2)
+            mocked_logger.assert_any_call(
+                f"Deleted 1 notifications older than {days_old} days "
+                "(batch 3, 5 in total)"
+            )
+            self.assertEqual(notification_queryset.count(), 1)
+
+        with self.subTest("Raw deletion updates unread counters"):
+            self._create_notification()
+            self._create_notification()
+            self.assertEqual(cache.get(cache_key), 3)
+            deleted = tasks.delete_old_notifications.delay(days_old, raw=True).get()
+            self.assertEqual(deleted, 2)
+            self.assertEqual(notification_queryset.count(), 1)
+            self.assertEqual(cache.get(cache_key), 1)
+
     @mock_notification_types
     def test_unregistered_notification_type_related_notification(self):
         # Notifications related to notification type should
@@ -1128,6 +1546,7 @@ class TestNotifications(TestOrganizationMixin, TransactionTestCase):
     )
     @patch("logging.Logger.warning")
     def test_post_migrate_handler_celery_broker_unreachable(self, mocked_logger, *args):
+        cache.delete(types.POPULATED_NOTIFICATION_TYPES_CACHE_KEY)
         post_migrate.send(
             sender=NotificationAppConfig, app_config=NotificationAppConfig
         )
@@ -1152,6 +1571,121 @@ class TestNotifications(TestOrganizationMixin, TransactionTestCase):
             )
             mocked_task.assert_called_once()
 
+    @mock_notification_types
+    def test_post_migrate_populates_only_changed_types(self):
+        admin = self._get_admin()
+        with self.subTest("Fingerprint is persisted after a full run"):
+            tasks.ns_register_unregister_notification_type()
+            self.assertEqual(
+                types.get_populated_notification_types(),
+                sorted(types.NOTIFICATION_TYPES),
+            )
+        with patch(
+            "openwisp_notifications.tasks.ns_register_unregister_notification_type.delay"
+        ) as mocked_task:
+            with self.subTest("Unchanged notification types are skipped"):
+                notification_type_registered_unregistered_handler(sender=self)
+                mocked_task.assert_not_called()
+
+            with self.subTest("Missing notification settings are populated"):
+                with transaction.atomic():
+                    NotificationSetting.objects.filter(user=admin).delete()
+                    notification_type_registered_unregistered_handler(sender=self)
+                    mocked_task.assert_called_once_with()
+                    transaction.set_rollback(True)
+                mocked_task.reset_mock()
+
+            with self.subTest("Only new notification types are populated"):
+                types.register_notification_type("test", test_notification_type)
+                types.unregister_notification_type("default")
+                notification_type_registered_unregistered_handler(sender=self)
+                mocked_task.assert_called_once_with(notification_types=["test"])
+
+        with self.subTest("Unregistered types do not dispatch shards"):
+            with patch.object(
+                tasks.ns_populate_notification_settings_shard, "si"
+            ) as mocked_shard:
+                tasks.ns_register_unregister_notification_type(notification_types=[])
+            mocked_shard.assert_not_called()
+
+        with self.subTest("Delta run creates settings of the new type only"):
+            tasks.ns_register_unregister_notification_type(notification_types=["test"])
+            self.assertTrue(
+                NotificationSetting.objects.filter(
+                    user=admin, type="test", deleted=False
+                ).exists()
+            )
+            self.assertFalse(
+                NotificationSetting.objects.filter(
+                    type="default", deleted=False
+                ).exists()
+            )
+            self.assertEqual(
+                types.get_populated_notification_types(),
+                sorted(types.NOTIFICATION_TYPES),
+            )
+
+    @mock_notification_types
+    @patch.object(app_settings, "POPULATE_PREFERENCES_SHARD_SIZE", 1)
+    def test_sharded_notification_settings_population(self):
+        admin = self._get_admin()
+        org = self._create_org(name="shard-org", slug="shard-org")
+        notification_types = list(types.NOTIFICATION_TYPES)
+        NotificationSetting.objects.all().delete()
+        tasks.ns_register_unregister_notification_type()
+        queryset = NotificationSetting.objects.filter(user=admin, deleted=False)
+        expected = Organization.objects.count() * len(notification_types)
+        self.assertEqual(queryset.exclude(type=None).count(), expected)
+        self.assertEqual(queryset.filter(type=None, organization=None).count(), 1)
+        self.assertEqual(
+            types.get_populated_notification_types(), sorted(notification_types)
+        )
+
+        with self.subTest("Shards are idempotent"):
+            tasks.ns_populate_notification_settings_shard(
+                notification_types, organization_ids=[str(org.pk)]
+            )
+            self.assertEqual(queryset.exclude(type=None).count(), expected)
+
+        with self.subTest("Fingerprint is persisted when the last task completes"):
+            cache.delete(types.POPULATED_NOTIFICATION_TYPES_CACHE_KEY)
+            cache.set(tasks.POPULATE_RUN_CACHE_KEY.format("run"), 2)
+            tasks.ns_populate_notification_settings_shard(
+                notification_types, organization_ids=[str(org.pk)], run_id="run"
+            )
+            self.assertIsNone(types.get_populated_notification_types())
+            tasks.ns_delete_unregistered_notification_types(
+                notification_types, run_id="run"
+            )
+            self.assertEqual(
+                types.get_populated_notification_types(), sorted(notification_types)
+            )
+            self.assertIsNone(cache.get(tasks.POPULATE_RUN_CACHE_KEY.format("run")))
+
+    def test_organization_created_burst_coalesced(self):
+        admin = self._get_admin()
+        queryset = NotificationSetting.objects.filter(
+            user=admin, organization__slug__startswith="burst-org"
+        ).exclude(type=None)
+        with patch.object(tasks.ns_organization_created, "apply_async") as mocked_task:
+            for index in range(3):
+                self._create_org(name=f"burst-org-{index}", slug=f"burst-org-{index}")
+        mocked_task.assert_called_once()
+        self.assertEqual(queryset.count(), 0)
+
+        tasks.ns_organization_created()
+        self.assertEqual(queryset.count(), 3 * len(types.NOTIFICATION_TYPES))
+        self.assertIsNone(cache.get(tasks.ORGANIZATION_CREATED_LOCK_KEY))
+
+        with self.subTest("Organizations are processed only once"):
+            with patch.object(
+                tasks, "bulk_create_notification_settings"
+            ) as mocked_bulk_create:
+                tasks.ns_organization_created()
+            self.assertEqual(
+                list(mocked_bulk_create.call_args.kwargs["organizations"]), []
+            )
+
     @patch("openwisp_notifications.types.NOTIFICATION_ASSOCIATED_MODELS", set())
     @patch("openwisp_notifications.tasks.delete_obsolete_objects.delay")
     def test_delete_obsolete_tasks(self, mocked_task, *args):
@@ -1159,6 +1693,128 @@ class TestNotifications(TestOrganizationMixin, TransactionTestCase):
         user.delete()
         mocked_task.assert_not_called()
 
+    def test_delete_obsolete_objects_batch(self):
+        users = [
+            self._create_user(username=f"obsolete{index}", email=f"o{index}@test.com")
+            for index in range(3)
+        ]
+        for user in users:
+            self._create_notification(target=user)
+        self.assertEqual(notification_queryset.count(), 3)
+        tasks.delete_obsolete_objects_batch(
+            [
+                (user._meta.app_label, user._meta.model_name, str(user.pk))
+                for user in users[:2]
+            ]
+            + [("invalid", "model", str(uuid4()))]
+        )
+        self.assertEqual(notification_queryset.count(), 1)
+        self.assertEqual(notification_queryset.first().target, users[2])
+
+    @mock_notification_types
+    @patch("openwisp_notifications.tasks.delete_obsolete_objects_batch.delay")
+    @patch("openwisp_notifications.tasks.delete_obsolete_objects.delay")
+    def test_related_object_deleted_buffered(self, mocked_task, mocked_batch_task):
+        register_notification_type("test", test_notification_type, models=[User])
+        self.addCleanup(types.NOTIFICATION_ASSOCIATED_MODELS.discard, User)
+        users = [
+            self._create_user(username=f"buffered{index}", email=f"b{index}@test.com")
+            for index in range(5)
+        ]
+        app_label, model_name = User._meta.app_label, User._meta.model_name
+
+        with self.subTest("Deletions are flushed on commit in one task"):
+            with transaction.atomic():
+                User.objects.filter(pk__in=[users[0].pk, users[1].pk]).delete()
+                mocked_batch_task.assert_not_called()
+            mocked_batch_task.assert_called_once()
+            mocked_task.assert_not_called()
+            self.assertEqual(
+                sorted(mocked_batch_task.call_args.args[0]),
+                sorted((app_label, model_name, str(user.pk)) for user in users[:2]),
+            )
+
+        with self.subTest("Rolled back deletions are discarded"):
+            mocked_batch_task.reset_mock()
+            user_pk = users[2].pk
+            with transaction.atomic():
+                User.objects.filter(pk=user_pk).delete()
+                transaction.set_rollback(True)
+            mocked_task.assert_not_called()
+            User.objects.filter(pk=user_pk).delete()
+            mocked_task.assert_called_once_with(app_label, model_name, str(user_pk))
+            mocked_batch_task.assert_not_called()
+
+        with self.subTest("Deletions of rolled back savepoints are discarded"):
+            mocked_task.reset_mock()
+            with transaction.atomic():
+                User.objects.filter(pk=users[3].pk).delete()
+                with transaction.atomic():
+                    User.objects.filter(pk=users[4].pk).delete()
+                    transaction.set_rollback(True)
+                mocked_task.assert_not_called()
+            mocked_task.assert_called_once_with(app_label, model_name, str(users[3].pk))
+            mocked_batch_task.assert_not_called()
+            self.assertTrue(User.objects.filter(pk=users[4].pk).exists())
+
+    @mock_notification_types
+    def test_notification_aggregation_window(self):
+        register_notification_type(
+            "flapping", dict(test_notification_type, aggregation_window=3600)
+        )
+        target = self._create_user(username="flapping", email="flapping@test.com")
+        queryset = Notification.objects.filter(recipient=self.admin, type="flapping")
+
+        notify.send(sender=self.admin, type="flapping", target=target)
+        self.assertEqual(queryset.count(), 1)
+        notification = queryset.first()
+
+        with self.subTest("Repeated notifications are aggregated"):
+            with patch.object(ws_handlers, "notification_update_handler") as mocked:
+                notify.send(sender=self.admin, type="flapping", target=target)
+                notify.send(
+                    sender=self.admin,
+                    type="flapping",
+                    target=target,
+                    description="Discarded description",
+                    extra="discarded",
+                )
+            self.assertEqual(mocked.call_count, 2)
+            mocked.assert_called_with(
+                reload_widget=True,
+                recipient=self.admin,
+                update={
+                    "action": "updated",
+                    "id": str(notification.pk),
+                    "unread": True,
+                },
+            )
+            self.assertEqual(queryset.count(), 1)
+            notification.refresh_from_db()
+            self.assertEqual(notification.data["aggregated_count"], 3)
+            self.assertNotIn("extra", notification.data)
+            self.assertIsNone(notification.description)
+            self.assertEqual(len(mail.outbox), 1)
+
+        with self.subTest("Other targets are not aggregated"):
+            notify.send(sender=self.admin, type="flapping", target=self.admin)
+            self.assertEqual(queryset.count(), 2)
+
+        with self.subTest("Read notifications are not aggregated"):
+            notification.mark_as_read()
+            notify.send(sender=self.admin, type="flapping", target=target)
+            self.assertEqual(queryset.count(), 3)
+
+        with self.subTest("Invalid aggregation window"):
+            with self.assertRaises(ImproperlyConfigured):
+                register_notification_type(
+                    "invalid", dict(test_notification_type, aggregation_window="1h")
+                )
+            with self.assertRaises(ImproperlyConfigured):
+                register_notification_type(
+                    "invalid", dict(test_notification_type, aggregation_window=0)
+                )
+
     def test_email_notif_without_notif_setting(self):
         target_obj = self._get_org_user()
         data = dict(
@@ -2075,6 +2731,120 @@ class TestNotificationSending(TestOrganizationMixin, TransactionTestCase):
             self._assert_notification_created(False)
             self._assert_email_sent(False)
 
+    def test_preference_matrix_cache(self):
+        user_pk = str(self.admin.pk)
+
+        def get_preferences():
+            return NotificationSetting.get_effective_preferences(
+                [self.admin.pk], self.org.pk, "default"
+            )
+
+        with self.subTest("Preferences are computed once and cached"):
+            with self.assertNumQueries(1):
+                self.assertEqual(get_preferences(), {user_pk: (True, True)})
+            with self.assertNumQueries(0):
+                self.assertEqual(get_preferences(), {user_pk: (True, True)})
+
+        with self.subTest("User setting changed"):
+            self._set_user_notification_settings("default", email=False)
+            self.assertEqual(get_preferences(), {user_pk: (True, False)})
+
+        with self.subTest("Organization setting changed"):
+            self._set_org_notification_settings(web=False, email=False)
+            self.assertEqual(get_preferences(), {user_pk: (False, False)})
+
+        with self.subTest("User setting updated through queryset"):
+            NotificationSetting.objects.filter(
+                user=self.admin, organization=self.org, type="default"
+            ).update(web=True)
+            self.assertEqual(get_preferences(), {user_pk: (True, False)})
+
+        with self.subTest("Global setting changed"):
+            self._set_global_notification_settings(web=False)
+            self.assertEqual(get_preferences(), {user_pk: (False, False)})
+
+        with self.subTest("Missing setting"):
+            NotificationSetting.objects.filter(
+                user=self.admin, organization=self.org, type="default"
+            ).delete()
+            self.assertEqual(get_preferences(), {user_pk: (False, False)})
+            self._send_notification("default")
+            self._assert_notification_created(False)
+
+    def test_recipients_cache(self):
+        org_admin = self._create_user(
+            username="org_admin", email="org_admin@example.com", is_staff=True
+        )
+
+        def get_recipients():
+            recipients = set(
+                Notification.objects.filter(
+                    target_object_id=self.target.pk
+                ).values_list("recipient__username", flat=True)
+            )
+            Notification.objects.all().delete()
+            return recipients
+
+        with self.subTest("Recipients are cached"):
+            self._send_notification("default")
+            self.assertEqual(get_recipients(), {"admin"})
+            with CaptureQueriesContext(connection) as context:
+                self._send_notification("default")
+            self.assertEqual(get_recipients(), {"admin"})
+            for query in context.captured_queries:
+                self.assertNotIn(OrganizationUser._meta.db_table, query["sql"])
+
+        with self.subTest("Organization user added"):
+            self._create_org_user(user=org_admin, organization=self.org, is_admin=True)
+            self._send_notification("default")
+            self.assertEqual(get_recipients(), {"admin", "org_admin"})
+
+        with self.subTest("User deactivated"):
+            org_admin.is_active = False
+            org_admin.save()
+            self._send_notification("default")
+            self.assertEqual(get_recipients(), {"admin"})
+
+        with self.subTest("Ignored objects are evaluated on each call"):
+            IgnoreObjectNotification.objects.create(
+                user=self.admin,
+                object_id=self.target.pk,
+                object_content_type=ContentType.objects.get_for_model(self.target),
+            )
+            self._send_notification("default")
+            self.assertEqual(get_recipients(), set())
+
+    @mock_notification_types
+    def test_recipient_queries_do_not_grow_with_settings(self):
+        setting_table = NotificationSetting._meta.db_table
+        user_table = User._meta.db_table
+
+        def capture_queries():
+            NotificationSetting.invalidate_preference_cache()
+            Notification.objects.all().delete()
+            with CaptureQueriesContext(connection) as context:
+                self._send_notification("default")
+            self._assert_notification_created(True)
+            return [query["sql"] for query in context.captured_queries]
+
+        baseline = capture_queries()
+        settings_count = NotificationSetting.objects.filter(user=self.admin).count()
+        for index in range(3):
+            self._create_org(name=f"org{index}", slug=f"org{index}")
+            register_notification_type(f"test_type_{index}", test_notification_type)
+        self.assertGreater(
+            NotificationSetting.objects.filter(user=self.admin).count(),
+            settings_count * 4,
+        )
+        queries = capture_queries()
+        self.assertEqual(len(queries), len(baseline))
+        for sql in queries:
+            # Only the settings of the notified organization and type are read
+            if f'FROM "{setting_table}"' in sql:
+                self.assertIn(f'"{setting_table}"."type" =', sql)
+            # Only the fields needed by the notification are loaded for users
+            self.assertNotIn(f'"{user_table}"."first_name"', sql)
+
 
 class TestTransactionNotifications(TestOrganizationMixin, TransactionTestCase):
     def setUp(self):
@@ -2114,3 +2884,110 @@ class TestTransactionNotifications(TestOrganizationMixin, TransactionTestCase):
         self.assertEqual(notification.target.username, "new operator name")
         # Done for populating cache
         self.assertEqual(operator_cache.username, "new operator name")
+
+    def test_rendered_notification_cache(self):
+        operator = self._get_operator()
+        register_notification_cache_update(
+            User, post_save, "operator_name_changed_invalidation"
+        )
+        self.notification_options.update({"target": operator, "type": "default"})
+        self._create_notification()
+        base_models._rendered_notifications.clear()
+        with patch.object(
+            base_models, "render_markdown", side_effect=utils.render_markdown
+        ) as mocked_render:
+            message = Notification.objects.first().message
+            self.assertIn(operator.username, message)
+            self.assertEqual(Notification.objects.first().message, message)
+            self.assertEqual(mocked_render.call_count, 1)
+
+            with self.subTest("Cache is invalidated when related objects change"):
+                operator.username = "renamed operator"
+                operator.save()
+                self.assertIn("renamed operator", Notification.objects.first().message)
+                self.assertEqual(mocked_render.call_count, 2)
+
+            with self.subTest("Cache is invalidated when the notification changes"):
+                Notification.objects.update(data={"message": "Changed message"})
+                self.assertIn("Changed message", Notification.objects.first().message)
+                self.assertEqual(mocked_render.call_count, 3)
+
+    @mock_notification_types
+    def test_rendered_notification_cache_type_registered_again(self):
+        register_notification_type(
+            "cached", dict(test_notification_type, message="First message")
+        )
+        self.notification_options.update({"type": "cached"})
+        self._create_notification()
+        base_models._rendered_notifications.clear()
+        self.assertIn("First message", Notification.objects.first().message)
+        for index in range(3):
+            with self.subTest(index=index):
+                unregister_notification_type("cached")
+                # The configuration may reuse the memory
+                # address of the previous configuration
+                gc.collect()
+                register_notification_type(
+                    "cached", dict(test_notification_type, message=f"Message {index}")
+                )
+                self.assertIn(f"Message {index}", Notification.objects.first().message)
+
+    @mock_notification_types
+    @patch.object(app_settings, "PRESENCE_REGISTRY", True)
+    def test_websocket_updates_skipped_for_offline_users(self):
+        admin2 = self._create_admin(username="admin2", email="admin2@example.com")
+        with patch.object(ws_handlers, "user_in_notification_storm") as mocked:
+            self._create_notification()
+            mocked.assert_not_called()
+
+        with self.subTest("Messages are rendered once per notify call"):
+            with patch.object(
+                Notification,
+                "_render_message",
+                autospec=True,
+                side_effect=Notification._render_message,
+            ) as mocked:
+                notify.send(sender=self.admin, type="default")
+            self.assertEqual(
+                Notification.objects.filter(recipient__in=[self.admin, admin2])
+                .values("recipient")
+                .distinct()
+                .count(),
+                2,
+            )
+            mocked.assert_called_once()
+
+        with self.subTest("Malformed notifications of offline users are deleted"):
+            register_notification_type(
+                "malformed",
+                dict(test_notification_type, message="{notification.actor.random}"),
+            )
+            queryset = Notification.objects.filter(type="malformed")
+            notify.send(sender=self.admin, type="malformed")
+            self.assertEqual(queryset.count(), 0)
+            with patch.object(app_settings, "BULK_CREATE", True):
+                notify.send(sender=self.admin, type="malformed")
+            self.assertEqual(queryset.count(), 0)
+
+        with self.subTest("Updates are sent to online users"):
+            ws_handlers.refresh_user_presence(self.admin.pk)
+            self.addCleanup(cache.delete, f"ow-notifications-presence-{self.admin.pk}")
+            with patch.object(
+                ws_handlers, "user_in_notification_storm", return_value=False
+            ) as mocked:
+                self._create_notification()
+            mocked.assert_called_once_with(self.admin)
+
+        with self.subTest("Batched updates are sent only to online users"):
+            with patch.object(app_settings, "BULK_CREATE", True), patch.object(
+                ws_handlers, "get_unread_counts", return_value={self.admin.pk: 1}
+            ) as mocked:
+                self._create_notification()
+            mocked.assert_called_once_with({self.admin.pk})
+
+        with self.subTest("All users are online if the registry is disabled"):
+            with patch.object(app_settings, "PRESENCE_REGISTRY", False):
+                self.assertEqual(
+                    ws_handlers.get_online_users([self.admin.pk, admin2.pk]),
+                    {self.admin.pk, admin2.pk},
+                )
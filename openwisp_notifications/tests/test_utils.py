@@ -38,12 +38,61 @@ class TestManagementCommands(TestCase, TestOrganizationMixin):
         management.call_command("create_notification")
         self.assertEqual(Notification.objects.count(), 0)
 
-    @patch(
-        "openwisp_notifications.tasks.ns_register_unregister_notification_type.delay"
-    )
-    def test_populate_notification_preferences_command(self, mocked_task):
-        management.call_command("populate_notification_preferences")
-        mocked_task.assert_called_once()
+    def test_populate_notification_preferences_command(self):
+        admin = self._get_admin()
+        org = self._get_org()
+        NotificationSetting.objects.filter(user=admin).delete()
+
+        with self.subTest("Dry run does not change preferences"):
+            stdout = StringIO()
+            management.call_command(
+                "populate_notification_preferences", dry_run=True, stdout=stdout
+            )
+            self.assertIn("would be created or revived", stdout.getvalue())
+            self.assertEqual(NotificationSetting.objects.filter(user=admin).count(), 0)
+
+        with self.subTest("Populate only selected types and organizations"):
+            stdout = StringIO()
+            management.call_command(
+                "populate_notification_preferences",
+                types=["default"],
+                orgs=[org.slug],
+                stdout=stdout,
+            )
+            self.assertIn("Processed 1 user(s)", stdout.getvalue())
+            self.assertEqual(
+                NotificationSetting.objects.filter(
+                    user=admin, organization=org, type="default"
+                ).count(),
+                1,
+            )
+            self.assertEqual(
+                NotificationSetting.objects.filter(user=admin)
+                .exclude(type__in=["default", None])
+                .count(),
+                0,
+            )
+
+        with self.subTest("Full run"):
+            stdout = StringIO()
+            management.call_command("populate_notification_preferences", stdout=stdout)
+            self.assertIn("notification preference(s) populated", stdout.getvalue())
+            self.assertEqual(
+                NotificationSetting.objects.filter(
+                    user=admin, organization=org, type="generic_message"
+                ).count(),
+                1,
+            )
+
+        with self.subTest("Invalid arguments"):
+            with self.assertRaises(management.CommandError):
+                management.call_command(
+                    "populate_notification_preferences", types=["invalid"]
+                )
+            with self.assertRaises(management.CommandError):
+                management.call_command(
+                    "populate_notification_preferences", orgs=["invalid"]
+                )
 
 
 class TestChecks(TestCase, TestOrganizationMixin):
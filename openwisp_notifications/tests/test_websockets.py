@@ -1,22 +1,25 @@
+import asyncio
 import uuid
-from datetime import timedelta
 from unittest.mock import patch
+from urllib.parse import quote
 
 import pytest
+from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
 from channels.testing import WebsocketCommunicator
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.models import ContentType
 from django.core.cache import cache
 from django.utils.module_loading import import_string
-from django.utils.timezone import now
-from freezegun import freeze_time
 
+from openwisp_notifications import settings as app_settings
 from openwisp_notifications.api.serializers import NotificationListSerializer
 from openwisp_notifications.signals import notify
 from openwisp_notifications.swapper import load_model
 from openwisp_notifications.tests.test_helpers import TEST_DATETIME
+from openwisp_notifications.websockets import handlers as ws_handlers
 from openwisp_notifications.websockets.consumers import NotificationConsumer
 
 User = get_user_model()
@@ -68,16 +71,57 @@ def create_object_notification(admin_user):
     return obj
 
 
+class BackoffWindows:
+    """
+    Replaces the sleep of the backoff windows of NotificationConsumer,
+    each window lasts until it is closed by the test.
+    """
+
+    def __init__(self):
+        self.durations = []
+        self.consumer = None
+        self._closed = asyncio.Event()
+
+    def patch(self):
+        flush_updates = NotificationConsumer._flush_updates
+
+        async def _flush_updates(consumer, delay):
+            self.durations.append(delay)
+            self.consumer = consumer
+            await self._closed.wait()
+            self._closed.clear()
+            await flush_updates(consumer, 0)
+
+        return patch.object(NotificationConsumer, "_flush_updates", _flush_updates)
+
+    async def close(self, suppressed_count):
+        """
+        Closes the current window once the consumer
+        has buffered ``suppressed_count`` updates.
+        """
+
+        async def buffered():
+            while (
+                self.consumer is None
+                or self.consumer._pending_update is None
+                or self.consumer._pending_update["suppressed_count"] < suppressed_count
+            ):
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(buffered(), timeout=5)
+        self._closed.set()
+
+
 @pytest.mark.asyncio
 @pytest.mark.django_db(transaction=True)
 class TestNotificationSockets:
     application = import_string(getattr(settings, "ASGI_APPLICATION"))
 
-    async def _get_communicator(self, admin_client):
+    async def _get_communicator(self, admin_client, path="ws/notification/"):
         session_id = admin_client.cookies["sessionid"].value
         communicator = WebsocketCommunicator(
             self.application,
-            path="ws/notification/",
+            path=path,
             headers=[
                 (
                     b"cookie",
@@ -96,8 +140,26 @@ class TestNotificationSockets:
         expected_response = {
             "type": "notification",
             "notification_count": 1,
-            "reload_widget": True,
+            "reload_widget": False,
             "notification": NotificationListSerializer(n).data,
+            "update": {"action": "created", "id": str(n.pk), "unread": True},
+            "suppressed_count": 0,
+        }
+        assert response == expected_response
+        await communicator.disconnect()
+
+    async def test_batched_notification_update(self, admin_user, admin_client):
+        communicator = await self._get_communicator(admin_client)
+        with patch.object(app_settings, "BULK_CREATE", True):
+            n = await create_notification(admin_user)
+        response = await communicator.receive_json_from()
+        expected_response = {
+            "type": "notification",
+            "notification_count": 1,
+            "reload_widget": False,
+            "notification": NotificationListSerializer(n).data,
+            "update": {"action": "created", "id": str(n.pk), "unread": True},
+            "suppressed_count": 0,
         }
         assert response == expected_response
         await communicator.disconnect()
@@ -112,20 +174,25 @@ class TestNotificationSockets:
             "notification_count": 0,
             "reload_widget": False,
             "notification": None,
+            "update": {"action": "updated", "id": str(n.pk), "unread": False},
+            "suppressed_count": 0,
         }
         assert response == expected_response
         await communicator.disconnect()
 
     async def test_delete_notification(self, admin_user, admin_client):
         n = await create_notification(admin_user)
+        notification_id = str(n.pk)
         communicator = await self._get_communicator(admin_client)
         await notification_operation(n, delete=True)
         response = await communicator.receive_json_from()
         expected_response = {
             "type": "notification",
             "notification_count": 0,
-            "reload_widget": True,
+            "reload_widget": False,
             "notification": None,
+            "update": {"action": "deleted", "id": notification_id, "unread": True},
+            "suppressed_count": 0,
         }
         assert response == expected_response
         await communicator.disconnect()
@@ -190,67 +257,239 @@ class TestNotificationSockets:
             assert response["valid_till"].split("T")[0] in TEST_DATETIME.isoformat()
         await communicator.disconnect()
 
+    @patch.object(NotificationConsumer, "_initial_backoff", 2)
+    @patch("openwisp_notifications.websockets.consumers.now", lambda: TEST_DATETIME)
     async def test_short_term_notification_storm_prevention(
         self, admin_user, admin_client
     ):
+        backoff_windows = BackoffWindows()
         communicator = await self._get_communicator(admin_client)
-        for _ in range(6):
-            await create_notification(admin_user)
-            response = await communicator.receive_json_from()
-            assert response["notification"] is not None
-            assert response["reload_widget"] is True
-        # After notification storms prevention starts
-        for _ in range(4):
-            await create_notification(admin_user)
+        with backoff_windows.patch():
+            for _ in range(6):
+                await create_notification(admin_user)
+                response = await communicator.receive_json_from()
+                assert response["notification"] is not None
+                assert response["reload_widget"] is False
+                assert response["update"]["action"] == "created"
+                assert response["suppressed_count"] == 0
+            # After notification storms prevention starts, updates are
+            # merged in a single message sent at the end of the backoff window
+            for _ in range(4):
+                await create_notification(admin_user)
+            await backoff_windows.close(suppressed_count=4)
             response = await communicator.receive_json_from()
-            assert response["notification"] is None
-            assert response["reload_widget"] is False
-
+        assert response == {
+            "type": "notification",
+            "notification_count": 10,
+            "reload_widget": True,
+            "notification": None,
+            "update": None,
+            "suppressed_count": 4,
+        }
+        assert backoff_windows.durations == [2]
         assert await communicator.receive_nothing() is True
         await communicator.disconnect()
 
-    @patch.object(NotificationConsumer, "_backoff_increment", 60)
-    @patch.object(NotificationConsumer, "_max_allowed_backoff", 5)
+    @patch.object(NotificationConsumer, "_initial_backoff", 1)
+    @patch.object(NotificationConsumer, "_backoff_increment", 1)
+    @patch.object(NotificationConsumer, "_max_allowed_backoff", 2)
+    @patch("openwisp_notifications.websockets.consumers.now", lambda: TEST_DATETIME)
     async def test_long_term_notification_storm_prevention(
         self, admin_user, admin_client
     ):
-        datetime_now = now()
-        freezer = freeze_time(datetime_now).start()
+        backoff_windows = BackoffWindows()
         await bulk_create_notification(admin_user, count=30)
-
-        # Establish connection
         communicator = await self._get_communicator(admin_client)
-
-        # Long term notification storm prevention takes over
-        freezer.move_to(datetime_now + timedelta(seconds=30))
-        # Set notification storm prevention in action.
-        # _initial_backoff is mocked since the time is frozen in this test
-        # which was leading to initialization case getting skipped.
-        with patch.object(NotificationConsumer, "_initial_backoff", 0):
-            await create_notification(admin_user)
-            response = await communicator.receive_json_from()
-
-        # These notifications will increment the backoff time beyond allowed limit.
-        for _ in range(2):
+        with backoff_windows.patch():
             await create_notification(admin_user)
+            await backoff_windows.close(suppressed_count=1)
             response = await communicator.receive_json_from()
             assert response["notification"] is None
-            assert response["reload_widget"] is False
+            assert response["notification_count"] == 31
+            assert response["suppressed_count"] == 1
+
+            for count in (33, 35):
+                for _ in range(2):
+                    await create_notification(admin_user)
+                await backoff_windows.close(suppressed_count=2)
+                response = await communicator.receive_json_from()
+                assert response["notification"] is None
+                assert response["reload_widget"] is True
+                assert response["notification_count"] == count
+                assert response["suppressed_count"] == 2
+        # The first window lasts "_initial_backoff" seconds, the following
+        # windows are incremented up to "_max_allowed_backoff"
+        assert backoff_windows.durations == [1, 2, 2]
+        assert await communicator.receive_nothing() is True
+        await communicator.disconnect()
 
-        # Reload widget when maximum backoff limit is reached
-        freezer.move_to(datetime_now + timedelta(seconds=40))
-        await create_notification(admin_user)
+    def _storm_event(self, notification_count, update=None):
+        return {
+            "type": "send.updates",
+            "reload_widget": False,
+            "notification": None,
+            "update": update,
+            "in_notification_storm": True,
+            "notification_count": notification_count,
+        }
+
+    @patch.object(NotificationConsumer, "_initial_backoff", 1)
+    @patch("openwisp_notifications.websockets.consumers.now", lambda: TEST_DATETIME)
+    async def test_flush_updates(self, admin_user, admin_client):
+        channel_layer = get_channel_layer()
+        communicator = await self._get_communicator(admin_client)
+        for notification_count, update in (
+            (5, None),
+            (6, {"action": "updated", "id": str(uuid.uuid4()), "unread": False}),
+            (7, None),
+        ):
+            await channel_layer.group_send(
+                f"ow-notification-{admin_user.pk}",
+                self._storm_event(notification_count, update),
+            )
+        # The updates received during the backoff window are
+        # merged in a single message sent at the end of the window
+        response = await communicator.receive_json_from(timeout=3)
+        assert response == {
+            "type": "notification",
+            "notification_count": 7,
+            "reload_widget": True,
+            "notification": None,
+            "update": None,
+            "suppressed_count": 3,
+        }
+        assert await communicator.receive_nothing(timeout=1.5) is True
+        await communicator.disconnect()
+
+    @patch.object(NotificationConsumer, "_initial_backoff", 0.5)
+    @patch("openwisp_notifications.websockets.consumers.now", lambda: TEST_DATETIME)
+    async def test_disconnect_during_backoff_window(self, admin_user, admin_client):
+        consumers = []
+        flush_updates = NotificationConsumer._flush_updates
+
+        async def _flush_updates(consumer, delay):
+            consumers.append(consumer)
+            await flush_updates(consumer, delay)
+
+        async def window_opened():
+            while not consumers:
+                await asyncio.sleep(0.01)
+
+        channel_layer = get_channel_layer()
+        communicator = await self._get_communicator(admin_client)
+        with patch.object(NotificationConsumer, "_flush_updates", _flush_updates):
+            await channel_layer.group_send(
+                f"ow-notification-{admin_user.pk}", self._storm_event(1)
+            )
+            await asyncio.wait_for(window_opened(), timeout=5)
+        flush_task = consumers[0]._flush_task
+        assert flush_task is not None and not flush_task.done()
+        await communicator.disconnect()
+        # The pending update is discarded without errors
+        assert await communicator.receive_nothing(timeout=1) is True
+        assert flush_task.cancelled()
+
+    async def test_missed_notifications(self, admin_user, admin_client):
+        notifications = [await create_notification(admin_user) for _ in range(3)]
+        last_seen = quote(notifications[0].timestamp.isoformat())
+        communicator = await self._get_communicator(
+            admin_client, path=f"ws/notification/?last_seen={last_seen}"
+        )
         response = await communicator.receive_json_from()
-        assert response["notification"] is None
-        assert response["reload_widget"] is True
-
-        # user_in_notification_storm cache expires and
-        # notification storm ends.
-        cache.delete(f"ow-noti-storm-{admin_user.pk}")
-        freezer.move_to(datetime_now + timedelta(seconds=200))
-        await create_notification(admin_user)
+        assert response == {
+            "type": "missed_notifications",
+            "notification_count": 3,
+            "reload_widget": False,
+            "notifications": [
+                NotificationListSerializer(n).data for n in notifications[:0:-1]
+            ],
+        }
+
+        # The id of the last seen notification can be sent as well
+        await communicator.send_json_to(
+            {"type": "last_seen", "last_seen": str(notifications[1].pk)}
+        )
         response = await communicator.receive_json_from()
-        assert response["notification"] is not None
-        assert response["reload_widget"] is True
+        assert response["notifications"] == [
+            NotificationListSerializer(notifications[2]).data
+        ]
+
+        with patch.object(NotificationConsumer, "_max_missed_notifications", 1):
+            await communicator.send_json_to(
+                {"type": "last_seen", "last_seen": str(notifications[0].pk)}
+            )
+            response = await communicator.receive_json_from()
+        assert response == {
+            "type": "missed_notifications",
+            "notification_count": 3,
+            "reload_widget": True,
+            "notifications": [],
+        }
+
+        for last_seen in ["invalid", str(uuid.uuid4()), None]:
+            await communicator.send_json_to(
+                {"type": "last_seen", "last_seen": last_seen}
+            )
+            assert await communicator.receive_nothing() is True
+        await communicator.disconnect()
 
+    @patch.object(NotificationConsumer, "_presence_heartbeat_interval", 0.1)
+    @patch.object(app_settings, "PRESENCE_REGISTRY", True)
+    async def test_presence_registry(self, admin_user, admin_client):
+        get_online_users = sync_to_async(ws_handlers.get_online_users)
+        delete_presence = sync_to_async(cache.delete)
+        presence_key = f"ow-notifications-presence-{admin_user.pk}"
+        await delete_presence(presence_key)
+        assert await get_online_users([admin_user.pk]) == set()
+        communicator = await self._get_communicator(admin_client)
+        assert await get_online_users([admin_user.pk]) == {admin_user.pk}
+        # The heartbeat restores the presence if it has been lost
+        await delete_presence(presence_key)
+        await asyncio.sleep(0.3)
+        assert await get_online_users([admin_user.pk]) == {admin_user.pk}
+        # The user is online until its last connection is closed
+        other_communicator = await self._get_communicator(admin_client)
         await communicator.disconnect()
+        assert await get_online_users([admin_user.pk]) == {admin_user.pk}
+        await other_communicator.disconnect()
+        assert await get_online_users([admin_user.pk]) == set()
+        # The presence is not refreshed anymore after disconnecting
+        await asyncio.sleep(0.3)
+        assert await get_online_users([admin_user.pk]) == set()
+
+    async def test_concurrent_connections(self, admin_user, admin_client):
+        # Many connections are served by the same event loop without
+        # going through the thread pool for each frame
+        connections = 50
+        communicators = await asyncio.gather(
+            *(self._get_communicator(admin_client) for _ in range(connections))
+        )
+        channel_layer = get_channel_layer()
+        for count in range(1, 6):
+            await channel_layer.group_send(
+                f"ow-notification-{admin_user.pk}",
+                {
+                    "type": "send.updates",
+                    "notification_count": count,
+                    "reload_widget": True,
+                    "notification": None,
+                    "in_notification_storm": False,
+                },
+            )
+            responses = await asyncio.gather(
+                *(communicator.receive_json_from() for communicator in communicators)
+            )
+            assert all(
+                response["type"] == "notification"
+                and response["notification_count"] == count
+                for response in responses
+            )
+        # Each connection receives exactly one message per update
+        assert all(
+            await asyncio.gather(
+                *(communicator.receive_nothing() for communicator in communicators)
+            )
+        )
+        await asyncio.gather(
+            *(communicator.disconnect() for communicator in communicators)
+        )
@@ -1,3 +1,11 @@
+import functools
+import hashlib
+import itertools
+import json
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
 from django.template.loader import get_template
 
@@ -37,6 +45,10 @@ NOTIFICATION_CHOICES = [
     ("generic_message", "Generic Message Type"),
 ]
 NOTIFICATION_ASSOCIATED_MODELS = set()
+# Maps the registered notification types to the number of their
+# registration, which changes when a type is registered again
+NOTIFICATION_TYPE_REGISTRATIONS = {}
+_registration_counter = itertools.count(1)
 
 
 def get_notification_configuration(notification_type):
@@ -50,6 +62,30 @@ def get_notification_configuration(notification_type):
         )
 
 
+def get_notification_type_registration(notification_type):
+    """
+    Returns the number of the registration of ``notification_type``,
+    notification types which are not registered at runtime return 0.
+    """
+    return NOTIFICATION_TYPE_REGISTRATIONS.get(notification_type, 0)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_compiled_template(template_name):
+    return get_template(template_name)
+
+
+def get_message_template(template_name):
+    """
+    Returns the compiled ``template_name`` template, templates are
+    compiled only once unless ``DEBUG`` is enabled, which allows
+    reloading edited templates during development.
+    """
+    if settings.DEBUG:
+        return get_template(template_name)
+    return _get_compiled_template(template_name)
+
+
 def _validate_notification_type(type_config):
     options = type_config.keys()
     assert "level" in options
@@ -58,7 +94,8 @@ def _validate_notification_type(type_config):
     assert ("message" in options) or ("message_template" in options)
 
     if "message_template" in options:
-        get_template(type_config["message_template"])
+        # Compiles the template at registration time
+        get_message_template(type_config["message_template"])
 
     if "email_notification" not in options:
         type_config["email_notification"] = True
@@ -66,6 +103,16 @@ def _validate_notification_type(type_config):
     if "web_notification" not in options:
         type_config["web_notification"] = True
 
+    aggregation_window = type_config.get("aggregation_window")
+    if aggregation_window is not None and (
+        isinstance(aggregation_window, bool)
+        or not isinstance(aggregation_window, int)
+        or aggregation_window <= 0
+    ):
+        raise ImproperlyConfigured(
+            "aggregation_window should be a positive number of seconds."
+        )
+
     return type_config
 
 
@@ -86,8 +133,16 @@ def register_notification_type(type_name, type_config, models=[]):
 
     validated_type_config = _validate_notification_type(type_config)
     NOTIFICATION_TYPES.update({type_name: validated_type_config})
+    NOTIFICATION_TYPE_REGISTRATIONS[type_name] = next(_registration_counter)
     _register_notification_choice(type_name, validated_type_config)
     NOTIFICATION_ASSOCIATED_MODELS.update(models)
+    # Models associated before loading of the app registry
+    # are connected in OpenwispNotificationsConfig.ready()
+    if models and apps.models_ready:
+        # Imported here to avoid circular imports
+        from openwisp_notifications.handlers import connect_related_object_deleted
+
+        connect_related_object_deleted(models)
 
 
 def unregister_notification_type(type_name):
@@ -97,6 +152,7 @@ def unregister_notification_type(type_name):
         raise ImproperlyConfigured(f"No such Notification Type, {type_name}")
 
     NOTIFICATION_TYPES.pop(type_name)
+    NOTIFICATION_TYPE_REGISTRATIONS.pop(type_name, None)
     _unregister_notification_choice(type_name)
 
 
@@ -120,3 +176,58 @@ def get_notification_choices():
     modules which register new notification types.
     """
     return NOTIFICATION_CHOICES
+
+
+POPULATED_NOTIFICATION_TYPES_CACHE_KEY = "ow-notifications-populated-types"
+
+
+def get_notification_types_fingerprint(notification_types=None):
+    """
+    Returns a stable fingerprint of the registered notification
+    types, or of the names in ``notification_types`` if passed.
+    """
+    if notification_types is None:
+        notification_types = NOTIFICATION_TYPES.keys()
+    names = json.dumps(sorted(notification_types))
+    return hashlib.sha256(names.encode()).hexdigest()
+
+
+def get_populated_notification_types():
+    """
+    Returns the names of the notification types for which notification
+    settings were populated by the last successful run, or ``None`` if
+    the notification settings were never populated.
+    """
+    populated = cache.get(POPULATED_NOTIFICATION_TYPES_CACHE_KEY)
+    if not populated:
+        return None
+    return populated["types"]
+
+
+def notification_types_changed():
+    """
+    Returns ``True`` if notification types have been registered or
+    unregistered since the notification settings were last populated.
+    """
+    populated = cache.get(POPULATED_NOTIFICATION_TYPES_CACHE_KEY)
+    if not populated:
+        return True
+    return populated["fingerprint"] != get_notification_types_fingerprint()
+
+
+def set_populated_notification_types(notification_types=None):
+    """
+    Persists the fingerprint of the notification types for which
+    notification settings have been populated successfully.
+    """
+    if notification_types is None:
+        notification_types = NOTIFICATION_TYPES.keys()
+    notification_types = sorted(notification_types)
+    cache.set(
+        POPULATED_NOTIFICATION_TYPES_CACHE_KEY,
+        {
+            "fingerprint": get_notification_types_fingerprint(notification_types),
+            "types": notification_types,
+        },
+        timeout=None,
+    )
@@ -1,8 +1,14 @@
 import json
+import threading
+from collections import OrderedDict
+from uuid import uuid4
 
 from django.conf import settings
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import F
 from django.template.loader import render_to_string
 from django.urls import NoReverseMatch, reverse
 from django.utils import timezone
@@ -10,6 +16,7 @@ from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
 from django.utils.translation import gettext as _
 from django.utils.translation import ngettext_lazy
+from markdown import Markdown
 
 from openwisp_notifications import settings as app_settings
 from openwisp_notifications.exceptions import NotificationRenderException
@@ -46,6 +53,79 @@ def normalize_unread_count(unread_count):
         return unread_count
 
 
+def get_cache_version(*keys):
+    """
+    Returns a token which changes whenever any of the cache
+    versions stored in ``keys`` is invalidated.
+    """
+    versions = cache.get_many(keys)
+    if len(versions) < len(keys):
+        for key in keys:
+            if key not in versions:
+                cache.add(key, uuid4().hex, timeout=None)
+        versions = cache.get_many(keys)
+    return "-".join(versions.get(key, "") for key in keys)
+
+
+def invalidate_cache_version(key):
+    """
+    Rotates the cache version stored in ``key``.
+
+    The version is rotated immediately and once more after the
+    current transaction is committed, so that values computed by
+    concurrent readers from uncommitted data are discarded.
+    """
+    cache.set(key, uuid4().hex, timeout=None)
+    transaction.on_commit(lambda: cache.set(key, uuid4().hex, timeout=None))
+
+
+_markdown = threading.local()
+
+
+def render_markdown(text):
+    """
+    Converts ``text`` to HTML, the ``Markdown`` instance
+    is reused by each thread instead of being built each time.
+    """
+    instance = getattr(_markdown, "instance", None)
+    if instance is None:
+        instance = _markdown.instance = Markdown()
+    return instance.reset().convert(text)
+
+
+class LRUCache:
+    """
+    Thread safe in-process cache which discards
+    the least recently used entries first.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            return self._data[key]
+
+    def set(self, key, value):
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
 def get_unsubscribe_url_for_user(user, full_url=True):
     token = email_token_generator.make_token(user)
     data = json.dumps({"user_id": str(user.id), "token": token})
@@ -178,3 +258,34 @@ def get_user_email_preference(notification):
         )
     except ObjectDoesNotExist:
         return False
+
+
+def get_email_notification_recipients(users, notification_type, organization_id=None):
+    """
+    Batched version of ``get_user_email_preference``.
+
+    Returns the set of primary keys of ``users`` which have a verified
+    email address and have email notifications enabled for
+    ``notification_type`` in the organization ``organization_id``.
+    Email preferences are read from the cached preference matrix,
+    at most two queries are executed regardless of the number of users.
+    """
+    from allauth.account.models import EmailAddress
+
+    user_pks = [user.pk for user in users]
+    if not user_pks:
+        return set()
+    verified = set(
+        EmailAddress.objects.filter(
+            user_id__in=user_pks, verified=True, email=F("user__email")
+        ).values_list("user_id", flat=True)
+    )
+    if not verified:
+        return verified
+    if not organization_id:
+        type_config = get_notification_configuration(notification_type)
+        return verified if type_config.get("email_notification", True) else set()
+    preferences = load_model("NotificationSetting").get_effective_preferences(
+        verified, organization_id, notification_type
+    )
+    return {user_id for user_id in verified if preferences[str(user_id)][1]}
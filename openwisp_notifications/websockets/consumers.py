@@ -1,95 +1,180 @@
+import asyncio
 import json
+from urllib.parse import parse_qs
 
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import WebsocketConsumer
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
 from django.contrib.contenttypes.models import ContentType
-from django.utils.timezone import now, timedelta
+from django.core.exceptions import ValidationError
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware, now, timedelta
 
-from openwisp_notifications.api.serializers import IgnoreObjectNotificationSerializer
+from openwisp_notifications.api.serializers import (
+    IgnoreObjectNotificationSerializer,
+    NotificationListSerializer,
+)
 from openwisp_notifications.swapper import load_model
+from openwisp_notifications.utils import normalize_unread_count
 
 from .. import settings as app_settings
+from . import handlers as ws_handlers
 
 Notification = load_model("Notification")
 IgnoreObjectNotification = load_model("IgnoreObjectNotification")
 
 
-class NotificationConsumer(WebsocketConsumer):
+class NotificationConsumer(AsyncWebsocketConsumer):
     _initial_backoff = app_settings.NOTIFICATION_STORM_PREVENTION["initial_backoff"]
     _backoff_increment = app_settings.NOTIFICATION_STORM_PREVENTION["backoff_increment"]
     _max_allowed_backoff = app_settings.NOTIFICATION_STORM_PREVENTION[
         "max_allowed_backoff"
     ]
+    # Maximum number of notifications sent to a client which reconnects,
+    # the client is asked to reload the notification widget if it has
+    # missed more notifications than this.
+    _max_missed_notifications = 50
+    _presence_heartbeat_interval = ws_handlers.PRESENCE_TIMEOUT / 2
 
-    def _is_user_authenticated(self):
+    async def _is_user_authenticated(self):
         try:
             assert self.scope["user"].is_authenticated is True
         except (KeyError, AssertionError):
-            self.close()
+            await self.close()
             return False
         else:
             return True
 
-    def connect(self):
-        if self._is_user_authenticated():
-            async_to_sync(self.channel_layer.group_add)(
+    async def connect(self):
+        if await self._is_user_authenticated():
+            await self.channel_layer.group_add(
                 "ow-notification-{0}".format(self.scope["user"].pk), self.channel_name
             )
-            self.accept()
+            await self.accept()
             self.scope["last_update_datetime"] = now()
             self.scope["backoff"] = self._initial_backoff
+            self._pending_update = None
+            self._flush_task = None
+            self._heartbeat_task = None
+            if app_settings.PRESENCE_REGISTRY:
+                await sync_to_async(ws_handlers.user_connected)(self.scope["user"].pk)
+                self._heartbeat_task = asyncio.ensure_future(self._presence_heartbeat())
+            query = parse_qs(self.scope.get("query_string", b"").decode())
+            if query.get("last_seen"):
+                await self._last_seen_handler(last_seen=query["last_seen"][0])
 
-    def disconnect(self, close_code):
-        async_to_sync(self.channel_layer.group_discard)(
+    async def disconnect(self, close_code):
+        if getattr(self, "_flush_task", None):
+            self._flush_task.cancel()
+        if getattr(self, "_heartbeat_task", None):
+            self._heartbeat_task.cancel()
+            await sync_to_async(ws_handlers.user_disconnected)(self.scope["user"].pk)
+        await self.channel_layer.group_discard(
             "ow-notification-{0}".format(self.scope["user"].pk), self.channel_name
         )
 
+    async def _presence_heartbeat(self):
+        while True:
+            await asyncio.sleep(self._presence_heartbeat_interval)
+            await sync_to_async(ws_handlers.refresh_user_presence)(
+                self.scope["user"].pk
+            )
+
+    def _buffer_event(self, event):
+        update = self._pending_update or {
+            "reload_widget": False,
+            "suppressed_count": 0,
+        }
+        update["notification_count"] = event["notification_count"]
+        # Changes to the notifications are not sent to the client,
+        # which has to reload the notification widget instead
+        update["reload_widget"] = (
+            update["reload_widget"]
+            or event["reload_widget"]
+            or event.get("update") is not None
+        )
+        update["suppressed_count"] += 1
+        self._pending_update = update
+
     def process_event_for_notification_storm(self, event):
+        """
+        Returns the event which shall be sent right away, or ``None``
+        if the event has been buffered until the end of the current
+        backoff window.
+        """
+        # Events received while a backoff window is open are merged
+        # in the update which is sent at the end of the window.
+        if self._pending_update is not None:
+            self._buffer_event(event)
+            return None
+        datetime_now = now()
         if not event["in_notification_storm"]:
+            self.scope["last_update_datetime"] = datetime_now
             return event
         # Removing notification is required to prevent frontend
-        # from showing toasts.
-        event["notification"] = None
-        datetime_now = now()
-        # If delay exceeds max_allowed_backoff, reset and send
-        # update. This is required to trigger reloading of
-        # notification widget.
-        if (
-            self.scope["last_update_datetime"] > datetime_now
-            and (self.scope["last_update_datetime"] - datetime_now).seconds
-            >= self._max_allowed_backoff
-        ):
-            self.scope["last_update_datetime"] = datetime_now
-            self.scope["backoff"] = self._initial_backoff
+        # from showing toasts. The notification widget is then
+        # reloaded to show the new notification.
+        if event["notification"] is not None:
             event["notification"] = None
-        elif self.scope["last_update_datetime"] > datetime_now - timedelta(
+            event["reload_widget"] = True
+        if self.scope["last_update_datetime"] > datetime_now - timedelta(
             seconds=self._initial_backoff
         ):
+            # The window never exceeds max_allowed_backoff, this makes
+            # the notification widget reload periodically during storms.
+            window = min(self.scope["backoff"], self._max_allowed_backoff)
             self.scope["last_update_datetime"] = datetime_now + timedelta(
-                seconds=self.scope["backoff"]
+                seconds=window
             )
             self.scope["backoff"] = self.scope["backoff"] + self._backoff_increment
-            event["reload_widget"] = False
-        else:
-            self.scope["last_update_datetime"] = datetime_now
-            self.scope["backoff"] = self._initial_backoff
+            self._buffer_event(event)
+            self._flush_task = asyncio.ensure_future(self._flush_updates(window))
+            return None
+        self.scope["last_update_datetime"] = datetime_now
+        self.scope["backoff"] = self._initial_backoff
         return event
 
-    def send_updates(self, event):
-        event = self.process_event_for_notification_storm(event)
-        self.send(
+    async def _flush_updates(self, delay):
+        await asyncio.sleep(delay)
+        update, self._pending_update = self._pending_update, None
+        self._flush_task = None
+        self.scope["last_update_datetime"] = now()
+        await self._send_update(notification=None, **update)
+
+    async def _send_update(
+        self,
+        notification_count,
+        reload_widget,
+        notification,
+        update=None,
+        suppressed_count=0,
+    ):
+        await self.send(
             json.dumps(
                 {
                     "type": "notification",
-                    "notification_count": event["notification_count"],
-                    "reload_widget": event["reload_widget"],
-                    "notification": event["notification"],
+                    "notification_count": notification_count,
+                    "reload_widget": reload_widget,
+                    "notification": notification,
+                    "update": update,
+                    "suppressed_count": suppressed_count,
                 }
             )
         )
 
-    def receive(self, text_data):
-        if self._is_user_authenticated():
+    async def send_updates(self, event):
+        event = self.process_event_for_notification_storm(event)
+        if event is None:
+            return
+        await self._send_update(
+            notification_count=event["notification_count"],
+            reload_widget=event["reload_widget"],
+            notification=event["notification"],
+            update=event.get("update"),
+        )
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if await self._is_user_authenticated():
             try:
                 json_data = json.loads(text_data)
             except json.JSONDecodeError:
@@ -97,18 +182,21 @@ class NotificationConsumer(WebsocketConsumer):
 
             try:
                 if json_data["type"] == "notification":
-                    self._notification_handler(
+                    await self._notification_handler(
                         notification_id=json_data["notification_id"]
                     )
                 elif json_data["type"] == "object_notification":
-                    self._object_notification_handler(
+                    await self._object_notification_handler(
                         object_id=json_data["object_id"],
                         app_label=json_data["app_label"],
                         model_name=json_data["model_name"],
                     )
+                elif json_data["type"] == "last_seen":
+                    await self._last_seen_handler(last_seen=json_data["last_seen"])
             except KeyError:
                 return
 
+    @database_sync_to_async
     def _notification_handler(self, notification_id):
         try:
             notification = Notification.objects.get(
@@ -118,24 +206,78 @@ class NotificationConsumer(WebsocketConsumer):
         except Notification.DoesNotExist:
             return
 
-    def _object_notification_handler(self, object_id, app_label, model_name):
+    @database_sync_to_async
+    def _get_object_notification_valid_till(self, object_id, app_label, model_name):
+        object_notification = IgnoreObjectNotification.objects.get(
+            user=self.scope["user"],
+            object_id=object_id,
+            object_content_type_id=ContentType.objects.get_by_natural_key(
+                app_label=app_label,
+                model=model_name,
+            ).pk,
+        )
+        serialized_data = IgnoreObjectNotificationSerializer(object_notification)
+        return serialized_data.data["valid_till"]
+
+    async def _object_notification_handler(self, object_id, app_label, model_name):
         try:
-            object_notification = IgnoreObjectNotification.objects.get(
-                user=self.scope["user"],
-                object_id=object_id,
-                object_content_type_id=ContentType.objects.get_by_natural_key(
-                    app_label=app_label,
-                    model=model_name,
-                ).pk,
-            )
-            serialized_data = IgnoreObjectNotificationSerializer(object_notification)
-            self.send(
-                json.dumps(
-                    {
-                        "type": "object_notification",
-                        "valid_till": serialized_data.data["valid_till"],
-                    }
-                )
+            valid_till = await self._get_object_notification_valid_till(
+                object_id, app_label, model_name
             )
         except IgnoreObjectNotification.DoesNotExist:
             return
+        await self.send(
+            json.dumps(
+                {
+                    "type": "object_notification",
+                    "valid_till": valid_till,
+                }
+            )
+        )
+
+    @database_sync_to_async
+    def _get_missed_notifications(self, last_seen):
+        """
+        Returns the notifications created after ``last_seen``, which
+        can be either the timestamp or the id of the last notification
+        seen by the client, or ``None`` if ``last_seen`` is not valid.
+        """
+        user = self.scope["user"]
+        try:
+            timestamp = parse_datetime(last_seen)
+        except (TypeError, ValueError):
+            timestamp = None
+        if timestamp is None:
+            try:
+                timestamp = (
+                    Notification.objects.only("timestamp")
+                    .get(recipient=user, id=last_seen)
+                    .timestamp
+                )
+            except (Notification.DoesNotExist, ValidationError, ValueError):
+                return None
+        elif is_naive(timestamp):
+            timestamp = make_aware(timestamp)
+        notifications = list(
+            Notification.objects.filter(
+                recipient=user, timestamp__gt=timestamp
+            ).order_by("-timestamp")[: self._max_missed_notifications + 1]
+        )
+        too_many = len(notifications) > self._max_missed_notifications
+        return {
+            "notification_count": normalize_unread_count(
+                Notification.get_unread_count(user)
+            ),
+            "reload_widget": too_many,
+            "notifications": (
+                []
+                if too_many
+                else NotificationListSerializer(notifications, many=True).data
+            ),
+        }
+
+    async def _last_seen_handler(self, last_seen):
+        missed = await self._get_missed_notifications(last_seen)
+        if missed is None:
+            return
+        await self.send(json.dumps({"type": "missed_notifications", **missed}))
@@ -1,6 +1,12 @@
+import asyncio
+from datetime import datetime
+from datetime import timezone as dt_timezone
+
 from asgiref.sync import async_to_sync
 from channels import layers
 from django.core.cache import cache
+from django.db.models import Count, F, Q, Window
+from django.db.models.functions import RowNumber
 from django.utils.timezone import now, timedelta
 
 from openwisp_notifications.api.serializers import NotFound, NotificationListSerializer
@@ -11,6 +17,268 @@ from ..swapper import load_model
 
 Notification = load_model("Notification")
 
+# Presence of a user expires if it is not refreshed by the
+# heartbeat of any of its websocket connections in this interval
+PRESENCE_TIMEOUT = 60
+
+
+def _presence_key(user_id):
+    return f"ow-notifications-presence-{user_id}"
+
+
+def user_connected(user_id):
+    """
+    Registers a websocket connection of ``user_id`` in the presence
+    registry, which keeps the number of open connections of each
+    user in the cache.
+    """
+    key = _presence_key(user_id)
+    cache.add(key, 0, PRESENCE_TIMEOUT)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The key has expired in the meantime
+        cache.set(key, 1, PRESENCE_TIMEOUT)
+    else:
+        cache.touch(key, PRESENCE_TIMEOUT)
+
+
+def user_disconnected(user_id):
+    """
+    Removes a websocket connection of ``user_id`` from the presence
+    registry, the user is removed when its last connection is closed.
+    Connections which are not closed cleanly (e.g. a crashed process)
+    are not removed, but expire with the heartbeat.
+    """
+    key = _presence_key(user_id)
+    try:
+        if cache.decr(key) <= 0:
+            cache.delete(key)
+    except ValueError:
+        pass
+
+
+def refresh_user_presence(user_id):
+    """
+    Extends the presence of ``user_id``, called periodically by each
+    of its open websocket connections. An expired presence is
+    registered again with a single connection, the presence of a
+    user whose other connections are still open is then restored
+    by their heartbeats.
+    """
+    key = _presence_key(user_id)
+    if not cache.touch(key, PRESENCE_TIMEOUT):
+        cache.add(key, 1, PRESENCE_TIMEOUT)
+
+
+def get_online_users(user_ids):
+    """
+    Returns the set of ``user_ids`` having at least one open
+    websocket connection, with a single cache lookup.
+
+    All the users are considered online if the presence
+    registry is disabled.
+    """
+    if not app_settings.PRESENCE_REGISTRY:
+        return set(user_ids)
+    keys = {user_id: _presence_key(user_id) for user_id in user_ids}
+    cached = cache.get_many(keys.values())
+    return {user_id for user_id, key in keys.items() if key in cached}
+
+
+def _storm_count_key(user_id, bucket):
+    return f"ow-noti-storm-count-{user_id}-{bucket}"
+
+
+def _storm_loaded_key(user_id):
+    return f"ow-noti-storm-loaded-{user_id}"
+
+
+def _storm_window():
+    """
+    Returns the number of recent notifications which are needed to
+    perform the notification storm checks, the longest time period
+    of the checks and the width (in seconds) of the time buckets in
+    which the notifications are counted.
+    """
+    config = app_settings.NOTIFICATION_STORM_PREVENTION
+    size = (
+        max(
+            config["short_term_notification_count"],
+            config["long_term_notification_count"],
+        )
+        + 1
+    )
+    period = max(config["short_term_time_period"], config["long_term_time_period"])
+    width = max(
+        1, min(config["short_term_time_period"], config["long_term_time_period"]) // 2
+    )
+    return size, period, width
+
+
+def _storm_bucket(timestamp, width):
+    return int(timestamp.timestamp()) // width
+
+
+def _storm_buckets(width, period, datetime_now=None):
+    """
+    Returns the time buckets which may contain the notifications
+    received in the longest time period of the checks.
+    """
+    current = _storm_bucket(datetime_now or now(), width)
+    return range(current - period // width - 1, current + 1)
+
+
+def _load_notification_counts(user_ids, datetime_now=None):
+    """
+    Loads the counters of the recent notifications of ``user_ids``
+    from the database. At most the number of notifications needed by
+    the checks is fetched for each user, with a single query.
+    The counters of the buckets without notifications are reset.
+    """
+    size, period, width = _storm_window()
+    datetime_now = datetime_now or now()
+    counts = {user_id: {} for user_id in user_ids}
+    for user_id, timestamp in (
+        Notification.objects.filter(
+            recipient_id__in=user_ids,
+            timestamp__gte=datetime_now - timedelta(seconds=period),
+        )
+        .annotate(
+            row_number=Window(
+                RowNumber(),
+                partition_by=F("recipient_id"),
+                order_by=F("timestamp").desc(),
+            )
+        )
+        .filter(row_number__lte=size)
+        .values_list("recipient_id", "timestamp")
+    ):
+        bucket = _storm_bucket(timestamp, width)
+        counts[user_id][bucket] = counts[user_id].get(bucket, 0) + 1
+    buckets = _storm_buckets(width, period, datetime_now)
+    cache.set_many(
+        {
+            _storm_count_key(user_id, bucket): user_counts.get(bucket, 0)
+            for user_id, user_counts in counts.items()
+            for bucket in set(buckets).union(user_counts)
+        },
+        period + width,
+    )
+    cache.set_many({_storm_loaded_key(user_id): True for user_id in user_ids}, period)
+    return counts
+
+
+def get_recent_notification_counts(user_ids, datetime_now=None):
+    """
+    Returns a dictionary mapping each of ``user_ids`` to a dictionary
+    which maps time buckets to the number of notifications the user
+    received in each of them, for the longest period of the checks.
+
+    The counters are kept in the cache and are incremented atomically
+    when notifications are created. The counters of users which are
+    not loaded are initialized from the database with a single query.
+    """
+    _, period, width = _storm_window()
+    keys = {}
+    for user_id in user_ids:
+        keys[_storm_loaded_key(user_id)] = (user_id, None)
+        for bucket in _storm_buckets(width, period, datetime_now):
+            keys[_storm_count_key(user_id, bucket)] = (user_id, bucket)
+    cached = cache.get_many(keys.keys())
+    counts = {user_id: {} for user_id in user_ids}
+    missing = set()
+    for key, (user_id, bucket) in keys.items():
+        if bucket is None:
+            if key not in cached:
+                missing.add(user_id)
+        elif cached.get(key):
+            counts[user_id][bucket] = cached[key]
+    if missing:
+        counts.update(_load_notification_counts(missing, datetime_now))
+    return counts
+
+
+def record_notification_timestamps(notifications):
+    """
+    Increments the counters of the recent notifications of the
+    recipients of the newly created ``notifications``.
+    """
+    _, period, width = _storm_window()
+    deltas = {}
+    for notification in notifications:
+        key = _storm_count_key(
+            notification.recipient_id, _storm_bucket(notification.timestamp, width)
+        )
+        deltas[key] = deltas.get(key, 0) + 1
+    for key, delta in deltas.items():
+        cache.add(key, 0, period + width)
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            # The counter has expired in the meantime
+            cache.set(key, delta, period + width)
+
+
+def discard_notification_timestamps(user_ids):
+    """
+    Discards the counters of the recent notifications of ``user_ids``,
+    they will be loaded again from the database when needed.
+    """
+    _, period, width = _storm_window()
+    keys = []
+    for user_id in user_ids:
+        keys.append(_storm_loaded_key(user_id))
+        keys.extend(
+            _storm_count_key(user_id, bucket)
+            for bucket in _storm_buckets(width, period)
+        )
+    cache.delete_many(keys)
+
+
+def _count_exceeds(user_id, counts, since, threshold):
+    """
+    Returns whether the notifications received by ``user_id`` since
+    ``since`` are more than ``threshold``, like counting them in the
+    database.
+
+    The counters of the buckets beginning after ``since`` are summed,
+    while only the notifications received since ``since`` are counted
+    in the bucket which contains it. These are counted in the database,
+    which is needed only if the result depends on them.
+    """
+    width = _storm_window()[2]
+    edge = _storm_bucket(since, width)
+    edge_end = datetime.fromtimestamp((edge + 1) * width, dt_timezone.utc)
+    recent = sum(value for bucket, value in counts.items() if bucket > edge)
+    edge_count = counts.get(edge, 0)
+    if edge_end - timedelta(seconds=width) == since:
+        # The bucket begins exactly at "since"
+        recent, edge_count = recent + edge_count, 0
+    if recent > threshold or recent + edge_count <= threshold:
+        return recent > threshold
+    recent += Notification.objects.filter(
+        recipient_id=user_id, timestamp__gte=since, timestamp__lt=edge_end
+    ).count()
+    return recent > threshold
+
+
+def _in_notification_storm(user_id, counts, datetime_now=None):
+    """
+    Performs the storm checks of ``user_id`` on the notification
+    counters returned by ``get_recent_notification_counts``.
+    """
+    config = app_settings.NOTIFICATION_STORM_PREVENTION
+    datetime_now = datetime_now or now()
+    for period, count in (
+        ("short_term_time_period", "short_term_notification_count"),
+        ("long_term_time_period", "long_term_notification_count"),
+    ):
+        since = datetime_now - timedelta(seconds=config[period])
+        if _count_exceeds(user_id, counts, since, config[count]):
+            return True
+    return False
+
 
 def user_in_notification_storm(user):
     """
@@ -19,40 +287,41 @@ def user_in_notification_storm(user):
     "OPENWISP_NOTIFICATIONS_NOTIFICATION_STORM_PREVENTION" setting.
     If the user is found to be affected by a notification storm,
     the value of this function is cached for 60 seconds.
+
+    The checks are performed on the counters of the recent
+    notifications of the user, which are kept in the cache.
     """
     in_notification_storm = cache.get(f"ow-noti-storm-{user.pk}", False)
     if in_notification_storm:
         return True
-    if (
-        user.notifications.filter(
-            timestamp__gte=now()
-            - timedelta(
-                seconds=app_settings.NOTIFICATION_STORM_PREVENTION[
-                    "short_term_time_period"
-                ]
-            )
-        ).count()
-        > app_settings.NOTIFICATION_STORM_PREVENTION["short_term_notification_count"]
-    ):
-        in_notification_storm = True
-    elif (
-        user.notifications.filter(
-            timestamp__gte=now()
-            - timedelta(
-                seconds=app_settings.NOTIFICATION_STORM_PREVENTION[
-                    "long_term_time_period"
-                ]
-            )
-        ).count()
-        > app_settings.NOTIFICATION_STORM_PREVENTION["long_term_notification_count"]
-    ):
-        in_notification_storm = True
+    counts = get_recent_notification_counts([user.pk])[user.pk]
+    in_notification_storm = _in_notification_storm(user.pk, counts)
     if in_notification_storm:
         cache.set(f"ow-noti-storm-{user.pk}", True, 60)
     return in_notification_storm
 
 
-def notification_update_handler(reload_widget=False, notification=None, recipient=None):
+def get_notification_update(notification, action):
+    """
+    Returns the description of the change of ``notification`` which
+    is sent to the websocket clients, allowing them to update the
+    notification widget without reloading it.
+
+    ``action`` is one of ``"created"``, ``"updated"`` or ``"deleted"``.
+    """
+    return {
+        "action": action,
+        "id": str(notification.pk),
+        "unread": notification.unread,
+    }
+
+
+def notification_update_handler(
+    reload_widget=False, notification=None, recipient=None, update=None
+):
+    # Users without open websocket connections do not receive updates
+    if not get_online_users([recipient.pk]):
+        return
     channel_layer = layers.get_channel_layer()
     try:
         assert notification is not None
@@ -65,10 +334,134 @@ def notification_update_handler(reload_widget=False, notification=None, recipien
             "type": "send.updates",
             "reload_widget": reload_widget,
             "notification": notification,
+            "update": update,
             "recipient": str(recipient.pk),
             "in_notification_storm": user_in_notification_storm(recipient),
             "notification_count": normalize_unread_count(
-                recipient.notifications.unread().count()
+                Notification.get_unread_count(recipient)
             ),
         },
     )
+
+
+def get_unread_counts(user_ids):
+    """
+    Returns a dictionary mapping each of ``user_ids`` to the number
+    of its unread notifications, read from the unread counters.
+    Missing counters are initialized with a single aggregate query.
+    """
+    keys = {user_id: Notification.count_cache_key(user_id) for user_id in user_ids}
+    cached = cache.get_many(keys.values())
+    unread_counts = {
+        user_id: cached[key] for user_id, key in keys.items() if key in cached
+    }
+    missing = [user_id for user_id in user_ids if user_id not in unread_counts]
+    if not missing:
+        return unread_counts
+    counts = dict(
+        Notification.objects.filter(recipient_id__in=missing)
+        .values("recipient_id")
+        .annotate(unread_count=Count("id", filter=Q(unread=True)))
+        .values_list("recipient_id", "unread_count")
+    )
+    for user_id in missing:
+        unread_counts[user_id] = Notification.init_unread_count(
+            user_id, counts.get(user_id, 0)
+        )
+    return unread_counts
+
+
+async def _group_send_many(channel_layer, messages):
+    await asyncio.gather(
+        *(channel_layer.group_send(group, message) for group, message in messages)
+    )
+
+
+# Fields of the websocket payload which differ among the
+# notifications created by the same ``notify`` call
+NOTIFICATION_ROW_FIELDS = ("id", "unread", "timestamp", "target_url")
+
+
+def _serialize_notifications(notifications):
+    """
+    Serializes ``notifications`` created by the same ``notify`` call.
+
+    The contents of the notifications do not depend on the recipient,
+    hence they are rendered only once, while the fields in
+    ``NOTIFICATION_ROW_FIELDS`` are serialized for each notification.
+    Returns ``None`` for each notification if they cannot be rendered.
+    """
+    try:
+        shared = NotificationListSerializer(notifications[0]).data
+    except NotFound:
+        return [None] * len(notifications)
+    fields = NotificationListSerializer().fields
+    payloads = []
+    for notification in notifications:
+        payload = dict(shared)
+        for name in NOTIFICATION_ROW_FIELDS:
+            payload[name] = fields[name].to_representation(getattr(notification, name))
+        payloads.append(payload)
+    return payloads
+
+
+def notifications_update_handler(notifications, reload_widget=False):
+    """
+    Batched version of ``notification_update_handler`` for
+    notifications created by the same ``notify`` call.
+
+    The related objects of all the notifications are loaded at once
+    and their contents are rendered only once, while the unread counts
+    of all recipients are read from their counters.
+    The updates are then sent concurrently to the groups of the
+    recipients which have open websocket connections.
+    """
+    online_users = get_online_users(
+        {notification.recipient_id for notification in notifications}
+    )
+    notifications = [
+        notification
+        for notification in notifications
+        if notification.recipient_id in online_users
+    ]
+    if not notifications:
+        return
+    channel_layer = layers.get_channel_layer()
+    Notification.prime_related_objects(notifications)
+    payloads = _serialize_notifications(notifications)
+    recipient_ids = {notification.recipient_id for notification in notifications}
+    unread_counts = get_unread_counts(recipient_ids)
+    storm_keys = {pk: f"ow-noti-storm-{pk}" for pk in recipient_ids}
+    cached_storms = cache.get_many(storm_keys.values())
+    datetime_now = now()
+    recent_counts = get_recent_notification_counts(
+        [pk for pk, key in storm_keys.items() if not cached_storms.get(key)],
+        datetime_now,
+    )
+    new_storms = {}
+    messages = []
+    for notification, payload in zip(notifications, payloads):
+        pk = notification.recipient_id
+        in_notification_storm = bool(cached_storms.get(storm_keys[pk]))
+        if not in_notification_storm and _in_notification_storm(
+            pk, recent_counts[pk], datetime_now
+        ):
+            in_notification_storm = True
+            new_storms[storm_keys[pk]] = True
+        messages.append(
+            (
+                f"ow-notification-{pk}",
+                {
+                    "type": "send.updates",
+                    "reload_widget": reload_widget,
+                    "notification": payload,
+                    "update": get_notification_update(notification, "created"),
+                    "recipient": str(pk),
+                    "in_notification_storm": in_notification_storm,
+                    "notification_count": normalize_unread_count(unread_counts[pk]),
+                },
+            )
+        )
+    if new_storms:
+        cache.set_many(new_storms, 60)
+    async_to_sync(_group_send_many)(channel_layer, messages)
@@ -0,0 +1,71 @@
+"""
+Compares the notification storm checks based on the counters kept
+in the cache with the previous checks, which counted the recent
+notifications of the user in the database on each websocket update.
+
+Run it from the "tests" directory with:
+
+    python manage.py test benchmarks.storm_checks
+"""
+
+import time
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now, timedelta
+
+from openwisp_notifications import settings as app_settings
+from openwisp_notifications.signals import notify
+from openwisp_notifications.websockets import handlers as ws_handlers
+from openwisp_users.tests.utils import TestOrganizationMixin
+
+STORM_NOTIFICATIONS = 300
+
+
+def db_storm_check(user):
+    config = app_settings.NOTIFICATION_STORM_PREVENTION
+    for period, count in (
+        ("short_term_time_period", "short_term_notification_count"),
+        ("long_term_time_period", "long_term_notification_count"),
+    ):
+        recent = user.notifications.filter(
+            timestamp__gte=now() - timedelta(seconds=config[period])
+        ).count()
+        if recent > config[count]:
+            return True
+    return False
+
+
+def cache_storm_check(user):
+    return ws_handlers.user_in_notification_storm(user)
+
+
+class TestStormChecksBenchmark(TestOrganizationMixin, TransactionTestCase):
+    def _measure(self, check, user):
+        # The result of the checks is cached during storms,
+        # it is discarded to measure the checks themselves
+        cache.delete(f"ow-noti-storm-{user.pk}")
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            result = check(user)
+            elapsed = time.perf_counter() - started
+        return result, len(context.captured_queries), elapsed
+
+    def test_storm_checks(self):
+        admin = self._create_admin()
+        totals = {check: [0, 0.0] for check in (db_storm_check, cache_storm_check)}
+        for _ in range(STORM_NOTIFICATIONS):
+            notify.send(sender=admin, type="default")
+            results = set()
+            for check, total in totals.items():
+                result, queries, elapsed = self._measure(check, admin)
+                results.add(result)
+                total[0] += queries
+                total[1] += elapsed
+            self.assertEqual(len(results), 1)
+        print(f"\nStorm checks of {STORM_NOTIFICATIONS} notifications:")
+        for check, (queries, elapsed) in totals.items():
+            print(f"  {check.__name__}: {queries} queries, {elapsed * 1000:.1f} ms")
+        self.assertLess(totals[cache_storm_check][0], totals[db_storm_check][0])
@@ -0,0 +1,121 @@
+"""
+Compares the connections and the messages handled per second by the
+asynchronous NotificationConsumer with the synchronous consumer used
+before, which ran the handlers of every connection in a worker thread.
+
+Run it from the "tests" directory with:
+
+    python manage.py test benchmarks.websocket_consumers
+"""
+
+import asyncio
+import json
+import time
+
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import WebsocketConsumer
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.test import TransactionTestCase
+
+from openwisp_notifications.websockets.consumers import NotificationConsumer
+from openwisp_users.tests.utils import TestOrganizationMixin
+
+CONNECTIONS = 200
+MESSAGES = 20
+
+
+class SyncNotificationConsumer(WebsocketConsumer):
+    """
+    Synchronous consumer used before NotificationConsumer, limited
+    to the handlers exercised by the benchmark. The benchmark does
+    not send notification storms, which this consumer would forward
+    right away as well.
+    """
+
+    def connect(self):
+        async_to_sync(self.channel_layer.group_add)(
+            "ow-notification-{0}".format(self.scope["user"].pk), self.channel_name
+        )
+        self.accept()
+
+    def disconnect(self, close_code):
+        async_to_sync(self.channel_layer.group_discard)(
+            "ow-notification-{0}".format(self.scope["user"].pk), self.channel_name
+        )
+
+    def send_updates(self, event):
+        self.send(
+            json.dumps(
+                {
+                    "type": "notification",
+                    "notification_count": event["notification_count"],
+                    "reload_widget": event["reload_widget"],
+                    "notification": event["notification"],
+                }
+            )
+        )
+
+
+class TestWebsocketConsumersBenchmark(TestOrganizationMixin, TransactionTestCase):
+    async def _connect(self, consumer, user):
+        communicator = WebsocketCommunicator(consumer.as_asgi(), "/ws/notification/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect(timeout=30)
+        self.assertTrue(connected)
+        return communicator
+
+    async def _measure(self, consumer, users):
+        channel_layer = get_channel_layer()
+        event = {
+            "type": "send.updates",
+            "reload_widget": False,
+            "notification": None,
+            "update": None,
+            "in_notification_storm": False,
+            "notification_count": 1,
+        }
+        started = time.perf_counter()
+        communicators = await asyncio.gather(
+            *(self._connect(consumer, user) for user in users)
+        )
+        connections_elapsed = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(MESSAGES):
+            await asyncio.gather(
+                *(
+                    channel_layer.group_send(f"ow-notification-{user.pk}", event)
+                    for user in users
+                )
+            )
+            frames = await asyncio.gather(
+                *(
+                    communicator.receive_json_from(timeout=30)
+                    for communicator in communicators
+                )
+            )
+            self.assertEqual(len(frames), len(users))
+        messages_elapsed = time.perf_counter() - started
+        await asyncio.gather(
+            *(communicator.disconnect() for communicator in communicators)
+        )
+        return (
+            len(users) / connections_elapsed,
+            len(users) * MESSAGES / messages_elapsed,
+        )
+
+    def test_consumers(self):
+        users = [
+            self._create_user(username=f"user{index}", email=f"user{index}@test.com")
+            for index in range(CONNECTIONS)
+        ]
+        print(
+            f"\nWebsocket consumers with {CONNECTIONS} connections"
+            f" and {MESSAGES} messages per connection:"
+        )
+        for consumer in (SyncNotificationConsumer, NotificationConsumer):
+            connections, messages = async_to_sync(self._measure)(consumer, users)
+            print(
+                f"  {consumer.__name__}: {connections:.1f} connections/s,"
+                f" {messages:.1f} messages/s"
+            )
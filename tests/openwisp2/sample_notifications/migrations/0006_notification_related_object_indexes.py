@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sample_notifications", "0005_make_notification_type_nonnullable"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["actor_content_type", "actor_object_id"],
+                name="sample_noti_actor_c_217fb2_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["action_object_content_type", "action_object_object_id"],
+                name="sample_noti_action__4d03a9_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["target_content_type", "target_object_id"],
+                name="sample_noti_target__c604e0_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sample_notifications", "0006_notification_related_object_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["recipient", "timestamp"],
+                name="sample_noti_recipie_16c194_idx",
+            ),
+        ),
+    ]
@@ -191,6 +191,10 @@ CELERY_BEAT_SCHEDULE = {
         "schedule": timedelta(days=1),
         "args": (90,),
     },
+    "reconcile_unread_counters": {
+        "task": "openwisp_notifications.tasks.reconcile_unread_counters",
+        "schedule": timedelta(hours=1),
+    },
 }
 
 ACCOUNT_AUTHENTICATED_LOGIN_REDIRECTS = False